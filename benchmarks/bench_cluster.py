@@ -0,0 +1,106 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+# Throughput of sharded batch prediction as the number of worker processes grows, against a synthetic offline
+# catalog.  Results use the run_benchmarks.py format, so --compare works on them too.
+#
+#   python benchmarks/bench_cluster.py --count 2000 --workers 1 2 4 8
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIRECTORY))
+
+from keplermatik_cluster import Router
+from run_benchmarks import DEFAULT_RESULTS_DIRECTORY, report
+from synthetic_catalog import SyntheticCatalog
+
+
+def prediction_requests(catalog, count, seed=0):
+    rng = random.Random(seed)
+    norad_cat_ids = list(catalog.tles)
+    return [(rng.choice(norad_cat_ids), rng.uniform(-60, 60), rng.uniform(-180, 180)) for _ in range(count)]
+
+
+def bench(count, worker_counts, requests, repeat):
+    catalog = SyntheticCatalog(count)
+    batch = prediction_requests(catalog, requests)
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        catalog.write(directory)
+
+        for workers in worker_counts:
+            with Router(directory) as router:
+                router.start(workers)
+                router.predict_batch(batch[:workers * 10])
+
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    router.predict_batch(batch)
+                    timings.append(time.perf_counter() - start)
+
+            result = {"case": "cluster_predict_batch[workers=%d,requests=%d]" % (workers, requests),
+                      "size": count,
+                      "runs": repeat,
+                      "min": min(timings),
+                      "median": statistics.median(timings),
+                      "mean": statistics.mean(timings),
+                      "peak_memory_bytes": None}
+            results.append(result)
+
+            print("%-48s %6d SATELLITES | median %8.3f s | %8.1f PREDICTIONS/S" %
+                  (result["case"], count, result["median"], requests / result["median"]))
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded prediction throughput by worker count")
+    parser.add_argument("--count", type=int, default=2000, help="satellites in the synthetic catalog")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=2000, help="predictions per batch")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/<commit>-cluster.json")
+    args = parser.parse_args()
+
+    results = report(bench(args.count, args.workers, args.requests, args.repeat))
+
+    output = args.output or os.path.join(DEFAULT_RESULTS_DIRECTORY, results["commit"] + "-cluster.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=4)
+
+    print("RESULTS | " + output)
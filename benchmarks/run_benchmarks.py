@@ -0,0 +1,321 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+# Microbenchmarks for the catalog and prediction hot paths, run against a synthetic offline catalog.
+#
+#   python benchmarks/run_benchmarks.py --sizes 1000 10000
+#   python benchmarks/run_benchmarks.py --compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+#
+# Each case is timed over --repeat runs, then run once more under tracemalloc for its peak allocation.  Every run
+# gets the synthetic catalog written into a fresh directory, so cases that rewrite the caches (cleanup_cache,
+# tle_cache.txt, the SatNOGS pickles) can't change what later cases read.  Results are written as JSON keyed by case
+# and catalog size so two runs from different commits can be compared.
+#
+# The suite drives the stateless Satellite API (keplermatik_satellites.timescale(), predict(t, lat, lon)), so the
+# oldest commit it can measure is the one that introduced it.  To measure an older checkout with this version of
+# the suite, point KEPLERMATIK_BENCHMARK_SOURCE at it, e.g. a git worktree:
+#
+#   KEPLERMATIK_BENCHMARK_SOURCE=/tmp/old python benchmarks/run_benchmarks.py --output old.json
+
+import argparse
+import contextlib
+import datetime
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIRECTORY = os.path.abspath(os.environ.get("KEPLERMATIK_BENCHMARK_SOURCE",
+                                                  os.path.dirname(BENCHMARKS_DIRECTORY)))
+sys.path.insert(0, SOURCE_DIRECTORY)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIRECTORY), "loadtest"))
+
+import keplermatik_satellites
+import satnogs_network
+from fake_upstream import FakeUpstream, UpstreamData
+from synthetic_catalog import SyntheticCatalog
+
+DEFAULT_RESULTS_DIRECTORY = os.path.join(BENCHMARKS_DIRECTORY, "results")
+
+OBSERVER_LATITUDE = 40.8939
+OBSERVER_LONGITUDE = -83.8917
+
+
+@contextlib.contextmanager
+def working_directory(directory):
+    previous = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+class Benchmark:
+
+    # A benchmark case is a setup callable returning the state for one run and a run callable taking that state.
+    # Setup is excluded from the timings.  max_size skips cases that scale too badly to be run at every size.
+
+    def __init__(self, name, setup, run, max_size=None):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.max_size = max_size
+
+    def measure(self, catalog, repeat):
+        timings = []
+        for _ in range(repeat):
+            with fresh_catalog(catalog):
+                state = self.setup()
+                gc.collect()
+                start = time.perf_counter()
+                self.run(state)
+                timings.append(time.perf_counter() - start)
+
+        with fresh_catalog(catalog):
+            state = self.setup()
+            gc.collect()
+            tracemalloc.start()
+            self.run(state)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        return {"runs": repeat,
+                "min": min(timings),
+                "median": statistics.median(timings),
+                "mean": statistics.mean(timings),
+                "peak_memory_bytes": peak_memory}
+
+
+@contextlib.contextmanager
+def fresh_catalog(catalog):
+    # a new working directory holding an untouched copy of the catalog, with no TLE files indexed by an earlier run
+    getattr(keplermatik_satellites, "_tle_indexes", {}).clear()
+
+    with tempfile.TemporaryDirectory() as directory, working_directory(directory):
+        catalog.write(directory)
+        yield directory
+
+
+def sample_satellites(catalog, sample):
+    satellites = {}
+    for satellite in catalog.satellites:
+        if satellite["norad_cat_id"] in catalog.celestrak_tles:
+            satellites[satellite["norad_cat_id"]] = keplermatik_satellites.Satellite(satellite)
+            if len(satellites) == sample:
+                break
+
+    return satellites
+
+
+def loaded_sample(catalog, sample):
+    satellites = sample_satellites(catalog, sample)
+    for satellite in satellites.values():
+        satellite.load_tle("tle_cache.txt")
+
+    return satellites
+
+
+def offline_satellites():
+    # a Satellites instance holding the parsed catalog, before any cleanup or TLE loading has run
+    satellites = dict.__new__(keplermatik_satellites.Satellites)
+    satellites.offline_flag = False
+    satellites.tle_source = "tle_cache.txt"
+    satellites.cleaned_up_satellites = []
+    satellites.not_found_satellites = []
+    satellites.satnogs_tle_satellites = []
+    satellites.stage_timings = {}
+    satnogs_network.SatnogsClient(satellites).get_satellites(offline=True)
+    return satellites
+
+
+@contextlib.contextmanager
+def local_upstream(catalog, latency):
+    # points the SatNOGS client at a local stand-in for the length of the block
+    urls = (satnogs_network.SATNOGS_DB_URL, satnogs_network.CELESTRAK_URL)
+
+    with FakeUpstream(UpstreamData.from_catalog(catalog), latency=latency) as upstream:
+        satnogs_network.SATNOGS_DB_URL = upstream.url
+        satnogs_network.CELESTRAK_URL = upstream.url
+        try:
+            yield upstream
+        finally:
+            satnogs_network.SATNOGS_DB_URL, satnogs_network.CELESTRAK_URL = urls
+
+
+def benchmarks(catalog, sample, upstream_latency):
+    ts = keplermatik_satellites.timescale()
+
+    def load_tle(satellites):
+        for satellite in satellites.values():
+            satellite.load_tle("tle_cache.txt")
+
+    def satnogs_parse(satellites):
+        satnogs_network.SatnogsClient(satellites).get_satellites(offline=True)
+
+    def cleanup_satellites(satellites):
+        satellites.cleanup_satellites()
+
+    def startup_offline(_):
+        keplermatik_satellites.Satellites(offline=True)
+
+    def startup_online(_):
+        with local_upstream(catalog, upstream_latency):
+            keplermatik_satellites.Satellites(offline=False)
+
+    def predict(satellites):
+        t = ts.now()
+        for satellite in satellites.values():
+            satellite.predict(t, OBSERVER_LATITUDE, OBSERVER_LONGITUDE)
+
+    def predict_passes(satellites):
+        t = ts.now()
+        for satellite in satellites.values():
+            satellite.predict_passes(t, t + 1, 0.0, OBSERVER_LONGITUDE, OBSERVER_LATITUDE)
+
+    return [Benchmark("load_tle[sample=%d]" % sample, lambda: sample_satellites(catalog, sample), load_tle),
+            Benchmark("satnogs_parse", dict, satnogs_parse),
+            Benchmark("cleanup_satellites", offline_satellites, cleanup_satellites),
+            Benchmark("startup_offline", dict, startup_offline),
+            Benchmark("startup_online[latency=%dms]" % (upstream_latency * 1000), dict, startup_online,
+                      max_size=10000),
+            Benchmark("predict[sample=%d]" % sample, lambda: loaded_sample(catalog, sample), predict),
+            Benchmark("predict_passes[sample=%d]" % sample, lambda: loaded_sample(catalog, sample), predict_passes)]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SOURCE_DIRECTORY,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(sizes, repeat, sample, selected=None, upstream_latency=0.05):
+    results = []
+
+    for size in sizes:
+        catalog = SyntheticCatalog(size)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+
+            for benchmark in benchmarks(catalog, sample, upstream_latency):
+                if selected and not any(name in benchmark.name for name in selected):
+                    continue
+                if benchmark.max_size is not None and size > benchmark.max_size:
+                    print("SKIPPED | " + benchmark.name + " | " + str(size) + " SATELLITES")
+                    continue
+
+                # setup and run print the same progress lines as production; keep the report readable
+                try:
+                    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                        result = benchmark.measure(catalog, repeat)
+                except Exception as e:
+                    # an older source tree may not have the API a newer case drives; report it and carry on
+                    print("FAILED | " + benchmark.name + " | " + str(size) + " SATELLITES | " + repr(e))
+                    continue
+
+                result.update({"case": benchmark.name, "size": size})
+                results.append(result)
+
+                print("%-32s %6d SATELLITES | median %10.4f s | min %10.4f s | peak %8.1f MB" %
+                      (benchmark.name, size, result["median"], result["min"], result["peak_memory_bytes"] / 1e6))
+
+    return report(results)
+
+
+def report(results):
+    return {"commit": git_commit(),
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results}
+
+
+def compare(old_filename, new_filename, threshold):
+    with open(old_filename) as file:
+        old = json.load(file)
+    with open(new_filename) as file:
+        new = json.load(file)
+
+    old_results = {(result["case"], result["size"]): result for result in old["results"]}
+    regressions = 0
+
+    print("%-32s %6s %12s %12s %8s" % ("CASE", "SIZE", old["commit"], new["commit"], "RATIO"))
+
+    for result in new["results"]:
+        key = (result["case"], result["size"])
+        if key not in old_results:
+            continue
+
+        ratio = result["median"] / old_results[key]["median"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+
+        print("%-32s %6d %10.4f s %10.4f s %7.2fx%s" % (key[0], key[1], old_results[key]["median"],
+                                                        result["median"], ratio, flag))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keplermatik hot path microbenchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--sample", type=int, default=100,
+                        help="satellites used by the per-satellite cases")
+    parser.add_argument("--case", nargs="+", help="only run cases whose name contains one of these")
+    parser.add_argument("--upstream-latency", type=float, default=0.05,
+                        help="seconds the stand-in SatNOGS/CelesTrak adds to each response for startup_online")
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="median slowdown reported as a regression when comparing")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+
+    results = run(args.sizes, args.repeat, args.sample, args.case, args.upstream_latency)
+
+    output = args.output or os.path.join(DEFAULT_RESULTS_DIRECTORY, results["commit"] + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=4)
+
+    print("RESULTS | " + output)
@@ -0,0 +1,254 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+# Generates a synthetic SatNOGS/CelesTrak catalog with no network access.  The output directory holds everything an
+# offline Satellites() run reads (the pickled SatNOGS responses, tle_cache.txt and cleanup_cache) plus the raw JSON
+# and TLE text the live services would return.
+#
+#   python benchmarks/synthetic_catalog.py --count 10000 --output /tmp/catalog
+
+import argparse
+import datetime
+import json
+import os
+import pickle
+import random
+import uuid
+
+import requests
+
+FIRST_NORAD_CAT_ID = 10000
+
+MODES = ["FM", "AFSK", "GMSK", "BPSK", "CW", "LoRa", "FSK"]
+
+
+def tle_checksum(line):
+    checksum = 0
+    for character in line:
+        if character.isdigit():
+            checksum += int(character)
+        elif character == "-":
+            checksum += 1
+
+    return str(checksum % 10)
+
+
+def tle_epoch(epoch):
+    day_of_year = epoch.timetuple().tm_yday
+    fraction = (epoch.hour * 3600 + epoch.minute * 60 + epoch.second) / 86400
+    return "%02d%012.8f" % (epoch.year % 100, day_of_year + fraction)
+
+
+def generate_tle(rng, norad_cat_id, name, now):
+    epoch = now - datetime.timedelta(days=rng.uniform(0, 14))
+    launch_year = rng.randint(1990, now.year)
+    international_designator = "%02d%03d%s" % (launch_year % 100, rng.randint(1, 300), rng.choice("ABCDEFGH"))
+
+    # mostly LEO with a sprinkling of MEO and GEO
+    orbit = rng.random()
+    if orbit < 0.85:
+        mean_motion = rng.uniform(14.0, 16.2)
+        inclination = rng.uniform(40.0, 99.0)
+        eccentricity = rng.randint(1, 200) * 10
+    elif orbit < 0.95:
+        mean_motion = rng.uniform(2.0, 12.0)
+        inclination = rng.uniform(0.0, 65.0)
+        eccentricity = rng.randint(1, 7000) * 100
+    else:
+        mean_motion = rng.uniform(1.0025, 1.0030)
+        inclination = rng.uniform(0.0, 5.0)
+        eccentricity = rng.randint(1, 50) * 10
+
+    line1 = "1 %05dU %-8s %s %10s %8s %8s 0 %4d" % (norad_cat_id, international_designator, tle_epoch(epoch),
+                                                     " .00001000", " 00000-0", " 10000-4", rng.randint(1, 999))
+    line2 = "2 %05d %8.4f %8.4f %07d %8.4f %8.4f %11.8f%5d" % (norad_cat_id, inclination, rng.uniform(0, 360),
+                                                              eccentricity, rng.uniform(0, 360),
+                                                              rng.uniform(0, 360), mean_motion,
+                                                              rng.randint(1, 99999))
+
+    return [name, line1 + tle_checksum(line1), line2 + tle_checksum(line2)]
+
+
+def generate_satellite(rng, norad_cat_id, now):
+    name = "SYNTH-%d" % norad_cat_id
+    updated = (now - datetime.timedelta(days=rng.uniform(0, 365))).isoformat() + "Z"
+
+    return {
+        "sat_id": "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(4)) + "-" + str(norad_cat_id),
+        "norad_cat_id": norad_cat_id,
+        "norad_follow_id": None,
+        "name": name,
+        "names": "",
+        "image": "",
+        "status": "alive",
+        "decayed": None,
+        "launched": None,
+        "deployed": None,
+        "website": "",
+        "operator": "None",
+        "countries": rng.choice(["US", "DE", "JP", "FR", "GB", "RU", "CN", "IN"]),
+        "telemetries": [],
+        "updated": updated,
+        "citation": "synthetic",
+        "is_frequency_violator": False,
+        "associated_satellites": [],
+    }
+
+
+def generate_transmitter(rng, satellite, now):
+    downlink = rng.randrange(144000000, 146000000, 5000) if rng.random() < 0.5 else \
+        rng.randrange(435000000, 438000000, 5000)
+    uplink = rng.randrange(144000000, 146000000, 5000) if rng.random() < 0.3 else None
+    mode = rng.choice(MODES)
+
+    return {
+        "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+        "description": mode + " downlink",
+        "alive": True,
+        "type": "Transceiver" if uplink else "Transmitter",
+        "uplink_low": uplink,
+        "uplink_high": None,
+        "uplink_drift": None,
+        "downlink_low": downlink,
+        "downlink_high": downlink,
+        "downlink_drift": None,
+        "mode": mode,
+        "mode_id": MODES.index(mode) + 1,
+        "uplink_mode": mode if uplink else None,
+        "invert": False,
+        "baud": rng.choice([1200.0, 9600.0, 19200.0]),
+        "sat_id": satellite["sat_id"],
+        "norad_cat_id": satellite["norad_cat_id"],
+        "norad_follow_id": None,
+        "status": "active",
+        "updated": satellite["updated"],
+        "citation": "synthetic",
+        "service": "Amateur",
+        "iaru_coordination": "IARU Coordinated",
+        "iaru_coordination_url": "",
+        "itu_notification": {"urls": []},
+        "frequency_violation": False,
+        "unconfirmed": False,
+    }
+
+
+class SyntheticCatalog:
+
+    def __init__(self, count, seed=0, missing_tle_fraction=0.05, satnogs_tle_fraction=0.05, now=None):
+        rng = random.Random(seed)
+        now = now or datetime.datetime.utcnow()
+
+        self.satellites = []
+        self.transmitters = []
+        self.celestrak_tles = {}
+        self.satnogs_tles = {}
+        self.missing_tles = []
+
+        for norad_cat_id in range(FIRST_NORAD_CAT_ID, FIRST_NORAD_CAT_ID + count):
+            satellite = generate_satellite(rng, norad_cat_id, now)
+            self.satellites.append(satellite)
+
+            for _ in range(rng.choice([1, 1, 1, 2, 3])):
+                self.transmitters.append(generate_transmitter(rng, satellite, now))
+
+            roll = rng.random()
+            tle = generate_tle(rng, norad_cat_id, satellite["name"], now)
+            if roll < missing_tle_fraction:
+                self.missing_tles.append(norad_cat_id)
+            elif roll < missing_tle_fraction + satnogs_tle_fraction:
+                self.satnogs_tles[norad_cat_id] = tle
+            else:
+                self.celestrak_tles[norad_cat_id] = tle
+
+    @property
+    def tles(self):
+        return {**self.celestrak_tles, **self.satnogs_tles}
+
+    @staticmethod
+    def tle_text(tles):
+        # the leading newline is for trees older than the TLE index, whose load_tle regex only matched entries
+        # following one; keeping it lets every commit the benchmarks can measure read the same files
+        return "\n" + "".join(line + "\r\n" for tle in tles.values() for line in tle)
+
+    def satnogs_tle_json(self, norad_cat_id):
+        if norad_cat_id not in self.satnogs_tles:
+            return []
+
+        tle0, tle1, tle2 = self.satnogs_tles[norad_cat_id]
+        return [{"tle0": tle0, "tle1": tle1, "tle2": tle2, "tle_source": "synthetic",
+                 "norad_cat_id": norad_cat_id, "updated": ""}]
+
+    def write(self, directory):
+        os.makedirs(directory, exist_ok=True)
+
+        satellites_json = json.dumps(self.satellites)
+        transmitters_json = json.dumps(self.transmitters)
+
+        files = {
+            "satellites.json": satellites_json,
+            "transmitters.json": transmitters_json,
+            "celestrak_tle.txt": self.tle_text(self.celestrak_tles),
+            "tle_cache.txt": self.tle_text(self.tles),
+            "cleanup_cache": json.dumps(self.missing_tles),
+        }
+
+        for filename, contents in files.items():
+            with open(os.path.join(directory, filename), "w") as file:
+                file.write(contents)
+
+        # the offline path of SatnogsClient.get_satellites unpickles the raw responses
+        for filename, body, url in [("satnogs_satellites", satellites_json, "https://db.satnogs.org/api/satellites/"),
+                                    ("satnogs_transmitters", transmitters_json,
+                                     "https://db.satnogs.org/api/transmitters/")]:
+            with open(os.path.join(directory, filename), "wb") as file:
+                pickle.dump(fake_response(body, url), file)
+
+        return directory
+
+
+def fake_response(body, url):
+    response = requests.Response()
+    response._content = body.encode("utf8")
+    response.status_code = 200
+    response.encoding = "utf-8"
+    response.url = url
+    response.headers["Content-Type"] = "application/json"
+    return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic offline SatNOGS/CelesTrak catalog")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    catalog = SyntheticCatalog(args.count, seed=args.seed)
+    catalog.write(args.output)
+
+    print("SYNTHETIC CATALOG | " + str(args.count) + " SATELLITES / " + str(len(catalog.transmitters)) +
+          " TRANSMITTERS | " + args.output)
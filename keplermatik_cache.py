@@ -0,0 +1,184 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+import asyncio
+import time
+
+
+class PredictionCache:
+
+    # Collapses concurrent identical prediction requests into a single computation and keeps the result around for
+    # a short TTL.  Requests are keyed by satellite, observer position quantised to observer_tolerance degrees and
+    # a time bucket of time_bucket seconds, so a burst of stations near each other asking about the same pass costs
+    # roughly one propagation per bucket.
+
+    def __init__(self, ttl=1.0, time_bucket=1.0, observer_tolerance=0.01, max_entries=10000):
+        self.ttl = ttl
+        self.time_bucket = time_bucket
+        self.observer_tolerance = observer_tolerance
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._results = {}
+        self._in_flight = {}
+
+    def key(self, norad_cat_id, observer_latitude, observer_longitude, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        return (norad_cat_id,
+                round(observer_latitude / self.observer_tolerance),
+                round(observer_longitude / self.observer_tolerance),
+                int(timestamp // self.time_bucket))
+
+    async def get(self, key, compute, *args):
+        now = time.monotonic()
+
+        cached = self._results.get(key)
+        if cached is not None:
+            expires, result = cached
+            if expires > now:
+                self.hits += 1
+                return result
+            del self._results[key]
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, compute, *args)
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._store(key, done))
+
+        # shield so a cancelled client doesn't cancel the computation the other waiters are sharing
+        return await asyncio.shield(future)
+
+    async def get_many(self, keys, compute, arguments, return_exceptions=False):
+        # Batch form of get: cached and in-flight keys are shared as usual, and the misses are computed together in
+        # a single executor job instead of one job per key.  Repeated keys within a batch coalesce onto one result.
+        # Each key succeeds or fails on its own; return_exceptions puts failures in the results, as asyncio.gather
+        # does, instead of raising the first one.
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+
+        futures = []
+        missing = []
+
+        for key, args in zip(keys, arguments):
+            cached = self._results.get(key)
+            if cached is not None:
+                expires, result = cached
+                if expires > now:
+                    self.hits += 1
+                    future = loop.create_future()
+                    future.set_result(result)
+                    futures.append(future)
+                    continue
+                del self._results[key]
+
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                future = loop.create_future()
+                self._in_flight[key] = future
+                future.add_done_callback(lambda done, key=key: self._store(key, done))
+                missing.append((future, args))
+
+            futures.append(future)
+
+        if missing:
+            batch = loop.run_in_executor(None, self._compute_all, compute, [args for future, args in missing])
+            batch.add_done_callback(lambda done: self._resolve(done, [future for future, args in missing]))
+
+        return await asyncio.shield(asyncio.gather(*futures, return_exceptions=return_exceptions))
+
+    @staticmethod
+    def _compute_all(compute, arguments):
+        # (result, exception) per key, so one failing key doesn't fail the rest of the batch or the requests that
+        # coalesced onto them
+        outcomes = []
+        for args in arguments:
+            try:
+                outcomes.append((compute(*args), None))
+            except Exception as e:
+                outcomes.append((None, e))
+
+        return outcomes
+
+    @staticmethod
+    def _resolve(batch, futures):
+        if batch.cancelled():
+            for future in futures:
+                future.cancel()
+        elif batch.exception() is not None:
+            for future in futures:
+                future.set_exception(batch.exception())
+        else:
+            for future, (result, exception) in zip(futures, batch.result()):
+                if exception is not None:
+                    future.set_exception(exception)
+                else:
+                    future.set_result(result)
+
+    def _store(self, key, future):
+        del self._in_flight[key]
+
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        now = time.monotonic()
+        if len(self._results) >= self.max_entries:
+            self._prune(now)
+
+        self._results[key] = (now + self.ttl, future.result())
+
+    def _prune(self, now):
+        for key in [key for key, (expires, result) in self._results.items() if expires <= now]:
+            del self._results[key]
+
+        if len(self._results) >= self.max_entries:
+            self._results.clear()
+
+    def clear(self):
+        self._results.clear()
+
+    @property
+    def stats(self):
+        requests = self.hits + self.misses + self.coalesced
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / requests if requests else 0.0,
+                "entries": len(self._results),
+                "in_flight": len(self._in_flight)}
@@ -0,0 +1,428 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+# Sharded prediction across local worker processes.  Each worker owns the satellites a consistent hash ring assigns
+# it and loads only those from the offline caches in a shared working directory.  The Router sends single
+# predictions to their owner, fans batches and catalog-wide queries out to every shard involved and merges the
+# results.  Workers can join or leave at any time; only the ids whose owner changes move.
+#
+# Rebalancing is two-phase so requests never reach a worker that hasn't loaded its satellites yet: workers first
+# load the union of their old and new partitions, then the router swaps in the new ring, then workers drop what they
+# no longer own.  Every request pins the ring generation it routes with, and the swap waits for requests still
+# pinned to an older generation before phase 2 runs or a removed worker is stopped.
+#
+# A worker whose process has died is replaced the first time a request finds it: a new worker takes its place on
+# the ring, and the request is retried once the rebalance is done.
+#
+# Workers only read the caches when their partition grows, so once something has rewritten them Router.refresh()
+# re-reads the catalog ids and has every worker reload its partition in place.
+
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import threading
+
+import satnogs_network
+from keplermatik_satellites import Satellites, unknown_prediction_summary
+
+
+class HashRing:
+
+    def __init__(self, nodes=(), replicas=160):
+        self.replicas = replicas
+        self._hashes = []
+        self._nodes = []
+
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(str(value).encode("utf8")).digest()[:8], "big")
+
+    @property
+    def nodes(self):
+        return set(self._nodes)
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = self._hash(str(node) + "#" + str(replica))
+            index = bisect.bisect(self._hashes, point)
+            self._hashes.insert(index, point)
+            self._nodes.insert(index, node)
+
+    def remove(self, node):
+        points = [(point, ring_node) for point, ring_node in zip(self._hashes, self._nodes) if ring_node != node]
+        self._hashes = [point for point, ring_node in points]
+        self._nodes = [ring_node for point, ring_node in points]
+
+    def node_for(self, key):
+        if not self._hashes:
+            raise LookupError("hash ring is empty")
+
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+    def partition(self, keys):
+        partitions = {node: set() for node in self.nodes}
+        for key in keys:
+            partitions[self.node_for(key)].add(key)
+
+        return partitions
+
+    def copy(self):
+        ring = HashRing(replicas=self.replicas)
+        ring._hashes = list(self._hashes)
+        ring._nodes = list(self._nodes)
+        return ring
+
+
+def _worker_main(connection, directory):
+    os.chdir(directory)
+
+    satellites = {}
+    assigned = frozenset()
+
+    while True:
+        operation, payload = connection.recv()
+
+        try:
+            if operation == "assign":
+                wanted = frozenset(payload)
+                if not wanted <= assigned:
+                    satellites = Satellites(offline=True, norad_cat_ids=wanted)
+                else:
+                    satellites = {norad_cat_id: satellite for norad_cat_id, satellite in satellites.items()
+                                  if norad_cat_id in wanted}
+                assigned = wanted
+                result = len(satellites)
+
+            elif operation == "reload":
+                assigned = frozenset(payload)
+                satellites = Satellites(offline=True, norad_cat_ids=assigned)
+                result = len(satellites)
+
+            elif operation == "predict_batch":
+                result = [satellites[norad_cat_id].prediction_summary(observer_latitude, observer_longitude)
+                          if norad_cat_id in satellites else unknown_prediction_summary(norad_cat_id)
+                          for norad_cat_id, observer_latitude, observer_longitude in payload]
+
+            elif operation == "catalog":
+                result = [(norad_cat_id, satellite.name) for norad_cat_id, satellite in satellites.items()]
+
+            elif operation == "stop":
+                connection.send(("ok", None))
+                break
+
+            else:
+                raise ValueError("unknown operation " + repr(operation))
+
+        except Exception as e:
+            connection.send(("error", repr(e)))
+        else:
+            connection.send(("ok", result))
+
+    connection.close()
+
+
+class WorkerError(Exception):
+    pass
+
+
+class WorkerDied(WorkerError):
+
+    def __init__(self, worker_id):
+        super().__init__("worker " + str(worker_id) + " | process is not running")
+        self.worker_id = worker_id
+
+
+class Worker:
+
+    def __init__(self, worker_id, process, connection):
+        self.worker_id = worker_id
+        self.process = process
+        self.connection = connection
+        self.satellite_count = 0
+        self.dead = False
+        self._lock = threading.Lock()
+
+    def call(self, operation, payload=None):
+        with self._lock:
+            if self.dead or not self.process.is_alive():
+                self.dead = True
+                raise WorkerDied(self.worker_id)
+
+            try:
+                self.connection.send((operation, payload))
+                status, result = self.connection.recv()
+            except (EOFError, OSError):
+                # the process went away mid-call and took its end of the pipe with it
+                self.dead = True
+                raise WorkerDied(self.worker_id)
+
+        if status != "ok":
+            raise WorkerError("worker " + str(self.worker_id) + " | " + result)
+
+        return result
+
+
+class Router:
+
+    def __init__(self, directory=None, replicas=160, attempts=3):
+        self.directory = os.path.abspath(directory or os.getcwd())
+        self.ring = HashRing(replicas=replicas)
+        self.generation = 0
+        self.workers = {}
+        self.norad_cat_ids = []
+        self.attempts = attempts
+
+        # requests in flight per ring generation, guarded by _ring_condition
+        self._readers = collections.Counter()
+        self._ring_condition = threading.Condition()
+
+        self._context = multiprocessing.get_context("spawn")
+        self._next_worker_id = 0
+        self._membership_lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=64)
+
+    def start(self, workers):
+        self.norad_cat_ids = satnogs_network.cached_norad_cat_ids(os.path.join(self.directory, 'satnogs_satellites'))
+
+        with self._membership_lock:
+            new_workers = [self._spawn() for _ in range(workers)]
+            ring = self.ring.copy()
+            for worker in new_workers:
+                ring.add(worker.worker_id)
+            self._rebalance(ring)
+
+        print("CLUSTER STARTED | " + str(len(self.norad_cat_ids)) + " SATELLITES / " + str(workers) + " WORKERS")
+        return self
+
+    def stop(self):
+        with self._membership_lock:
+            for worker in list(self.workers.values()):
+                self._stop_worker(worker)
+            self.workers.clear()
+            self.ring = HashRing(replicas=self.ring.replicas)
+
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def add_worker(self):
+        with self._membership_lock:
+            worker = self._spawn()
+            ring = self.ring.copy()
+            ring.add(worker.worker_id)
+            self._rebalance(ring)
+
+        return worker.worker_id
+
+    def remove_worker(self, worker_id):
+        with self._membership_lock:
+            if worker_id not in self.workers:
+                raise KeyError(worker_id)
+            if len(self.workers) == 1:
+                raise ValueError("can't remove the last worker")
+
+            ring = self.ring.copy()
+            ring.remove(worker_id)
+            self._rebalance(ring)
+
+            self._stop_worker(self.workers.pop(worker_id))
+
+    def refresh(self):
+        # reloads every worker from the offline caches, picking up satellites added to or dropped from the catalog
+        for attempt in range(self.attempts):
+            try:
+                with self._membership_lock:
+                    return self._reload()
+            except WorkerDied as e:
+                if attempt == self.attempts - 1:
+                    raise
+                dead_worker_id = e.worker_id
+
+            self._replace_worker(dead_worker_id)
+
+    def _reload(self):
+        self.norad_cat_ids = satnogs_network.cached_norad_cat_ids(os.path.join(self.directory, 'satnogs_satellites'))
+
+        # the ring doesn't change, so each worker swaps its partition wholesale and keeps serving the old one until
+        # the new one is loaded
+        partitions = self.ring.partition(self.norad_cat_ids)
+        counts = self._fan_out({worker_id: ("reload", partition) for worker_id, partition in partitions.items()})
+        for worker_id, count in counts.items():
+            self.workers[worker_id].satellite_count = count
+
+        print("CLUSTER REFRESHED | " + str(len(self.norad_cat_ids)) + " SATELLITES / " + str(len(counts)) +
+              " WORKERS")
+        return self.status
+
+    def _replace_worker(self, worker_id):
+        # swaps a dead worker for a fresh one; every request that finds it dead ends up here, the first one does it
+        with self._membership_lock:
+            worker = self.workers.get(worker_id)
+            if worker is None or not worker.dead:
+                return
+
+            print("WORKER DIED | WORKER " + str(worker_id) + " | REPLACING")
+            replacement = self._spawn()
+            ring = self.ring.copy()
+            ring.remove(worker_id)
+            ring.add(replacement.worker_id)
+            self._rebalance(ring)
+
+            self._stop_worker(self.workers.pop(worker_id))
+
+    def _spawn(self):
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+
+        parent_connection, child_connection = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_connection, self.directory),
+                                        name="keplermatik-shard-" + str(worker_id), daemon=True)
+        process.start()
+        child_connection.close()
+
+        worker = Worker(worker_id, process, parent_connection)
+        self.workers[worker_id] = worker
+        return worker
+
+    def _stop_worker(self, worker):
+        try:
+            worker.call("stop")
+        except (OSError, EOFError, WorkerError):
+            pass
+
+        worker.process.join(timeout=10)
+        if worker.process.is_alive():
+            worker.process.terminate()
+
+    def _rebalance(self, ring):
+        old_partitions = self.ring.partition(self.norad_cat_ids) if self.ring.nodes else {}
+        new_partitions = ring.partition(self.norad_cat_ids)
+
+        # phase 1: everyone loads what they will own while still serving what they own now
+        self._fan_out({worker_id: ("assign", new_partitions[worker_id] | old_partitions.get(worker_id, set()))
+                       for worker_id in new_partitions})
+
+        self._swap_ring(ring)
+
+        # phase 2: drop ids that moved elsewhere
+        counts = self._fan_out({worker_id: ("assign", new_partitions[worker_id]) for worker_id in new_partitions})
+        for worker_id, count in counts.items():
+            self.workers[worker_id].satellite_count = count
+
+        print("CLUSTER REBALANCED | " + ", ".join("WORKER " + str(worker_id) + ": " + str(count) + " SATELLITES"
+                                                  for worker_id, count in sorted(counts.items())))
+
+    def _swap_ring(self, ring):
+        # installs ring and waits until no request is still routing with an older one
+        with self._ring_condition:
+            self.ring = ring
+            self.generation += 1
+            self._ring_condition.wait_for(lambda: all(generation == self.generation for generation in self._readers))
+
+    @contextlib.contextmanager
+    def _reading(self):
+        # pins the current ring for the length of a request
+        with self._ring_condition:
+            ring, generation = self.ring, self.generation
+            self._readers[generation] += 1
+
+        try:
+            yield ring
+        finally:
+            with self._ring_condition:
+                self._readers[generation] -= 1
+                if not self._readers[generation]:
+                    del self._readers[generation]
+                self._ring_condition.notify_all()
+
+    def _route(self, request):
+        # runs request(ring) on a pinned ring, replacing any worker found dead and retrying on the rebalanced ring
+        for attempt in range(self.attempts):
+            try:
+                with self._reading() as ring:
+                    return request(ring)
+            except WorkerDied as e:
+                if attempt == self.attempts - 1:
+                    raise
+                dead_worker_id = e.worker_id
+
+            self._replace_worker(dead_worker_id)
+
+    def _fan_out(self, calls):
+        futures = {worker_id: self._pool.submit(self.workers[worker_id].call, operation, payload)
+                   for worker_id, (operation, payload) in calls.items()}
+
+        return {worker_id: future.result() for worker_id, future in futures.items()}
+
+    def predict(self, norad_cat_id, observer_latitude, observer_longitude):
+        return self.predict_batch([(norad_cat_id, observer_latitude, observer_longitude)])[0]
+
+    def predict_batch(self, requests):
+        return self._route(lambda ring: self._predict_batch(ring, requests))
+
+    def _predict_batch(self, ring, requests):
+        batches = {}
+        for index, request in enumerate(requests):
+            indexes, payload = batches.setdefault(ring.node_for(request[0]), ([], []))
+            indexes.append(index)
+            payload.append(tuple(request))
+
+        results = [None] * len(requests)
+        partial_results = self._fan_out({worker_id: ("predict_batch", payload)
+                                         for worker_id, (indexes, payload) in batches.items()})
+        for worker_id, (indexes, payload) in batches.items():
+            for index, result in zip(indexes, partial_results[worker_id]):
+                results[index] = result
+
+        return results
+
+    def catalog(self):
+        return self._route(self._catalog)
+
+    def _catalog(self, ring):
+        partial_results = self._fan_out({worker_id: ("catalog", None) for worker_id in ring.nodes})
+        return sorted(entry for entries in partial_results.values() for entry in entries)
+
+    @property
+    def status(self):
+        return {"satellites": len(self.norad_cat_ids),
+                "workers": {worker_id: {"pid": worker.process.pid,
+                                        "alive": worker.process.is_alive(),
+                                        "satellites": worker.satellite_count}
+                            for worker_id, worker in self.workers.items()}}
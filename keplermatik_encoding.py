@@ -0,0 +1,210 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+# Response encodings chosen from the request's Accept header.  JSON is always available and uses orjson when it is
+# installed; MessagePack and Arrow IPC (stream and file formats) are offered when msgpack and pyarrow are.  Columnar results (dicts of numpy
+# arrays from vectorized propagation) are handed to orjson and Arrow as arrays, without building a Python object
+# per row.
+
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+ARROW_FILE = "application/vnd.apache.arrow.file"
+
+ALIASES = {
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+}
+
+
+def available_media_types():
+    media_types = [JSON]
+    if msgpack is not None:
+        media_types.append(MSGPACK)
+    if pyarrow is not None:
+        media_types.append(ARROW)
+        media_types.append(ARROW_FILE)
+
+    return media_types
+
+
+def negotiate(accept):
+    # the best available media type for an Accept header, JSON if there is no header, None if nothing fits
+    if not accept:
+        return JSON
+
+    available = available_media_types()
+    preferences = []
+
+    for position, item in enumerate(accept.split(",")):
+        media_type, *parameters = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        if quality > 0:
+            preferences.append((-quality, position, ALIASES.get(media_type.lower(), media_type.lower())))
+
+    for _, _, media_type in sorted(preferences):
+        if media_type in available:
+            return media_type
+        if media_type in ("*/*", "application/*"):
+            return JSON
+
+    return None
+
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, tuple) and hasattr(value, "_asdict"):
+        return value._asdict()
+
+    raise TypeError("Object of type " + type(value).__name__ + " is not JSON serializable")
+
+
+def _plain(value):
+    # msgpack has no numpy support, so arrays go over as lists, one column at a time.  Missing values (NaN, and
+    # infinities) become None, which is what orjson writes for them and the only way to send them as valid JSON
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == "f":
+            missing = ~np.isfinite(value)
+            if missing.any():
+                value = value.astype(object)
+                value[missing] = None
+        return value.tolist()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return value if np.isfinite(value) else None
+    if isinstance(value, tuple) and hasattr(value, "_asdict"):
+        return {name: _plain(item) for name, item in value._asdict().items()}
+    if isinstance(value, dict):
+        return {name: _plain(item) for name, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+
+    return value
+
+
+def encode_json(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+    # the standard library writes namedtuples as arrays without asking default, so convert them up front
+    return json.dumps(_plain(data), allow_nan=False).encode("utf8")
+
+
+def encode(data, media_type):
+    # data is anything JSON-like, optionally holding numpy arrays and namedtuples
+    if media_type == MSGPACK:
+        return msgpack.packb(_plain(data))
+    if media_type in (ARROW, ARROW_FILE):
+        raise ValueError("Arrow responses need columnar data, use encode_columns or encode_rows")
+
+    return encode_json(data)
+
+
+def encode_columns(columns, media_type):
+    # columns maps field names to equal length numpy arrays or lists; JSON and MessagePack send them as an object
+    # of arrays and Arrow as a record batch stream
+    if media_type in (ARROW, ARROW_FILE):
+        return _arrow(pyarrow.table(columns), media_type)
+
+    return encode(columns, media_type)
+
+
+def encode_rows(rows, media_type):
+    # rows is a sequence of dicts or namedtuples; JSON and MessagePack send a list of objects and Arrow a table
+    if media_type in (ARROW, ARROW_FILE):
+        return _arrow(pyarrow.Table.from_pylist([_plain(row) for row in rows]), media_type)
+
+    return encode(list(rows), media_type)
+
+
+def _arrow(table, media_type):
+    # the file format adds the magic bytes and footer that random-access readers (pyarrow.ipc.open_file) need
+    sink = pyarrow.BufferOutputStream()
+    new_writer = pyarrow.ipc.new_file if media_type == ARROW_FILE else pyarrow.ipc.new_stream
+    with new_writer(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+def _json_prediction(prediction):
+    maximum_elevation = prediction["maximum_elevation"]
+    return dict(prediction, maximum_elevation="" if maximum_elevation is None else
+                str(round(maximum_elevation, 2)) + " degrees")
+
+
+def encode_prediction(prediction, media_type):
+    # a /predict_now/ result; JSON keeps its original shape with maximum elevation as a "12.34 degrees" string,
+    # the binary encodings send the number
+    if media_type in (ARROW, ARROW_FILE):
+        return encode_rows([prediction], media_type)
+
+    if media_type == JSON:
+        prediction = _json_prediction(prediction)
+
+    return encode(prediction, media_type)
+
+
+def encode_predictions(predictions, media_type):
+    # /predict_batch/ results, each row shaped the way encode_prediction shapes a single one
+    if media_type == JSON:
+        return encode([_json_prediction(prediction) for prediction in predictions], media_type)
+
+    return encode_rows(predictions, media_type)
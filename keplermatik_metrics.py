@@ -0,0 +1,237 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+# Minimal in-process metrics rendered in the Prometheus text format.  Recording an observation is a bisect and a
+# couple of additions under an uncontended lock; anything that has to walk the catalog (catalog size, TLE ages,
+# cache stats) is a function metric evaluated only when /metrics is scraped.
+
+import asyncio
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(name + "=\"" + _escape(value) + "\"" for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value))
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        # re-registering a name replaces the old metric, so reimporting a module doesn't leave stale callbacks
+        self.metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name):
+        self.metrics.pop(name, None)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append("# HELP " + metric.name + " " + metric.help)
+            lines.append("# TYPE " + metric.name + " " + metric.type)
+            lines.extend(metric.collect())
+
+        return "\n".join(lines) + "\n"
+
+
+class Histogram:
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+
+        # label values -> [per bucket counts (last is +Inf), sum]
+        self._children = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            child = self._children.get(label_values)
+            if child is None:
+                child = self._children[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+
+            child[0][index] += 1
+            child[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def timed(self, *label_values):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *label_values)
+
+            return wrapper
+
+        return decorator
+
+    def collect(self):
+        with self._lock:
+            children = [(label_values, list(counts), total) for label_values, (counts, total) in
+                        self._children.items()]
+
+        lines = []
+        for label_values, counts, total in children:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(self.name + "_bucket" + _labels(self.label_names, label_values, [("le", _number(bound))]) +
+                             " " + str(cumulative))
+            lines.append(self.name + "_sum" + _labels(self.label_names, label_values) + " " + _number(total))
+            lines.append(self.name + "_count" + _labels(self.label_names, label_values) + " " + str(cumulative))
+
+        return lines
+
+
+class FunctionMetric:
+
+    # A gauge or counter whose value is read from function at scrape time.  The function returns either a single
+    # number or a dict of label value tuples to numbers.
+
+    def __init__(self, name, help, function, labels=(), type="gauge"):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.label_names = tuple(labels)
+        self.type = type
+
+    def collect(self):
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+
+        return [self.name + _labels(self.label_names, label_values) + " " + _number(value)
+                for label_values, value in values.items()]
+
+
+class FunctionHistogram:
+
+    # A histogram built from scratch at every scrape out of the values returned by function.
+
+    type = "histogram"
+
+    def __init__(self, name, help, function, buckets):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.buckets = tuple(buckets)
+
+    def collect(self):
+        histogram = Histogram(self.name, self.help, buckets=self.buckets)
+        for value in self.function():
+            histogram.observe(value)
+
+        return histogram.collect()
+
+
+registry = Registry()
+
+tle_parse_seconds = registry.register(Histogram(
+    "keplermatik_tle_parse_seconds", "Time spent parsing a TLE file into an index by NORAD id"))
+
+propagation_seconds = registry.register(Histogram(
+    "keplermatik_propagation_seconds", "Time spent in SGP4 propagation and geodetic conversion"))
+
+topocentric_seconds = registry.register(Histogram(
+    "keplermatik_topocentric_seconds", "Time spent converting a position to observer azimuth, elevation and range"))
+
+pass_search_seconds = registry.register(Histogram(
+    "keplermatik_pass_search_seconds", "Time spent searching for passes over an observer"))
+
+upstream_fetch_seconds = registry.register(Histogram(
+    "keplermatik_upstream_fetch_seconds", "Time spent fetching data from SatNOGS and CelesTrak", labels=["source"]))
+
+http_request_seconds = registry.register(Histogram(
+    "keplermatik_http_request_seconds", "Time spent serving HTTP requests", labels=["method", "path", "status"]))
+
+event_loop_lag_seconds = registry.register(Histogram(
+    "keplermatik_event_loop_lag_seconds", "How late the event loop woke up a periodic timer"))
+
+startup_stage_seconds = registry.register(Histogram(
+    "keplermatik_startup_stage_seconds", "Time spent in each stage of building the catalog", labels=["stage"]))
+
+
+@contextlib.contextmanager
+def stage(name, timings=None):
+    # times one stage of a catalog build, reporting it the same way as the rest of the startup output
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        startup_stage_seconds.observe(elapsed, name)
+        if timings is not None:
+            timings[name] = elapsed
+        print("STAGE | " + name.upper() + " | " + "%.3f" % elapsed + " s")
+
+
+async def monitor_event_loop_lag(interval=0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - start - interval))
@@ -0,0 +1,323 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+# Opt-in profiling of single requests and catalog refreshes.  Profiles are written in the folded stack format
+# ("frame;frame;frame count" per line) that flamegraph.pl, speedscope and inferno read directly.
+#
+# A profiled request carries its Profile in a context variable.  Executor work the request hands off through
+# Profiler.wrap runs as part of that profile, so the propagation and pass searches that do the real work show up
+# in it even though they run on another thread.
+#
+# "sample" mode snapshots the stack of whichever executor thread is working for the request at a fixed interval;
+# it is cheap enough to leave on for a small fraction of traffic.  Ticks where none is count towards a single
+# "<event loop>" frame, the time the request spent on or waiting for the loop.  "deterministic" mode hooks every call
+# in the request's executor work with sys.setprofile and records microseconds of self time per stack; it is exact
+# but slow.  Neither mode looks inside the event loop thread, which also runs every other request's coroutines.
+#
+#   KEPLERMATIK_PROFILING=1                  enable the profiling surface at all
+#   KEPLERMATIK_PROFILE_MODE=sample          default mode, "sample" or "deterministic"
+#   KEPLERMATIK_PROFILE_SAMPLE_RATE=0.001    fraction of requests profiled without being asked
+#   KEPLERMATIK_PROFILE_INTERVAL=0.005       seconds between stack samples
+#   KEPLERMATIK_PROFILE_DIRECTORY=profiles   where profiles are written
+#   KEPLERMATIK_PROFILE_KEEP=100             newest profiles kept on disk
+
+import collections
+import contextlib
+import contextvars
+import datetime
+import functools
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+PROFILE_HEADER = "X-Keplermatik-Profile"
+PROFILE_ID_HEADER = "X-Keplermatik-Profile-Id"
+
+MODES = ("sample", "deterministic")
+
+EVENT_LOOP_STACK = "<event loop>"
+
+_active_profile = contextvars.ContextVar("keplermatik_active_profile", default=None)
+
+
+def _frame_name(code):
+    return os.path.basename(code.co_filename) + ":" + code.co_name
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval=0.005, thread_ids=None, idle_stack=None):
+        # thread_ids None samples every thread; idle_stack, if given, is counted on ticks where none of thread_ids
+        # was running
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.idle_stack = idle_stack
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="keplermatik-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+
+        while not self._stop.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = False
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+                sampled = True
+
+            if not sampled and self.idle_stack is not None:
+                self.stacks[self.idle_stack] += 1
+
+
+class DeterministicProfiler:
+
+    def __init__(self):
+        self.stacks = collections.Counter()
+        self._stack = []
+        self._base = ""
+
+    def start(self, frame):
+        # frame and its callers are already running when profiling starts and form the root of every stack
+        frames = []
+        while frame is not None:
+            frames.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+
+        self._base = ";".join([threading.current_thread().name] + list(reversed(frames)))
+        sys.setprofile(self._profile)
+
+    def stop(self):
+        sys.setprofile(None)
+        return self.stacks
+
+    def _profile(self, frame, event, arg):
+        now = time.perf_counter()
+
+        if event == "call" or event == "c_call":
+            name = _frame_name(frame.f_code) if event == "call" else \
+                "<builtin>:" + getattr(arg, "__qualname__", getattr(arg, "__name__", repr(arg)))
+            parent = self._stack[-1][0] if self._stack else self._base
+            # [stack key, start, time spent in children]
+            self._stack.append([parent + ";" + name, now, 0.0])
+
+        elif self._stack and event in ("return", "c_return", "c_exception"):
+            key, start, children = self._stack.pop()
+            elapsed = now - start
+            self.stacks[key] += max(0, int((elapsed - children) * 1e6))
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+
+class Profile:
+
+    def __init__(self, label, mode):
+        self.label = label
+        self.mode = mode
+        self.id = None
+
+        # threads the sampler follows, and stacks recorded by deterministic runs of the profile's executor work
+        self.thread_ids = set()
+        self.stacks = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, function, *args):
+        # runs function on the calling thread as part of this profile
+        if self.mode == "deterministic":
+            profiler = DeterministicProfiler()
+            profiler.start(sys._getframe(1))
+            try:
+                return function(*args)
+            finally:
+                stacks = profiler.stop()
+                with self._lock:
+                    self.stacks.update(stacks)
+
+        thread_id = threading.get_ident()
+        with self._lock:
+            self.thread_ids.add(thread_id)
+        try:
+            return function(*args)
+        finally:
+            with self._lock:
+                self.thread_ids.discard(thread_id)
+
+
+class Profiler:
+
+    def __init__(self, enabled=False, mode="sample", sample_rate=0.0, interval=0.005, directory="profiles",
+                 keep=100):
+        if mode not in MODES:
+            raise ValueError("profile mode must be one of " + ", ".join(MODES))
+
+        self.enabled = enabled
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.directory = directory
+        self.keep = keep
+
+        self._armed = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        return cls(enabled=os.environ.get("KEPLERMATIK_PROFILING", "0") == "1",
+                   mode=os.environ.get("KEPLERMATIK_PROFILE_MODE", "sample"),
+                   sample_rate=float(os.environ.get("KEPLERMATIK_PROFILE_SAMPLE_RATE", "0")),
+                   interval=float(os.environ.get("KEPLERMATIK_PROFILE_INTERVAL", "0.005")),
+                   directory=os.environ.get("KEPLERMATIK_PROFILE_DIRECTORY", "profiles"),
+                   keep=int(os.environ.get("KEPLERMATIK_PROFILE_KEEP", "100")))
+
+    def arm(self, count=1):
+        with self._lock:
+            self._armed += count
+
+    def requested_mode(self, header=None):
+        # the mode to profile a request with, or None to leave it alone
+        if not self.enabled:
+            return None
+
+        if header:
+            return header if header in MODES else self.mode
+
+        with self._lock:
+            if self._armed > 0:
+                self._armed -= 1
+                return self.mode
+
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.mode
+
+        return None
+
+    @contextlib.contextmanager
+    def profile(self, label, mode=None, thread_ids=None):
+        profile = Profile(label, mode if mode in MODES else self.mode)
+
+        if profile.mode == "deterministic":
+            profiler = DeterministicProfiler()
+            # skip this generator and contextlib's __enter__ to root stacks at the code being profiled
+            profiler.start(sys._getframe(2))
+        else:
+            profiler = SamplingProfiler(self.interval, thread_ids)
+            profiler.start()
+
+        try:
+            yield profile
+        finally:
+            profile.id = self._save(profile, profiler.stop())
+
+    @contextlib.contextmanager
+    def profile_request(self, label, mode=None):
+        # profiles one request through the executor work it hands off with wrap()
+        profile = Profile(label, mode if mode in MODES else self.mode)
+
+        sampler = None
+        if profile.mode == "sample":
+            sampler = SamplingProfiler(self.interval, profile.thread_ids, idle_stack=EVENT_LOOP_STACK)
+            sampler.start()
+
+        token = _active_profile.set(profile)
+        try:
+            yield profile
+        finally:
+            _active_profile.reset(token)
+            if sampler is not None:
+                profile.stacks.update(sampler.stop())
+            profile.id = self._save(profile, profile.stacks)
+
+    def wrap(self, function):
+        # binds function to the current request's profile, if it has one; run_in_executor doesn't carry context
+        # variables over to the executor thread, so this has to happen before the work is handed off
+        profile = _active_profile.get()
+        if profile is None:
+            return function
+
+        return functools.partial(profile.record, function)
+
+    def run(self, label, mode, function, *args):
+        # profiles function on whichever thread runs it, for work handed to an executor
+        with self.profile(label, mode, thread_ids={threading.get_ident()}) as profile:
+            result = function(*args)
+
+        return result, profile.id
+
+    def _save(self, profile, stacks):
+        os.makedirs(self.directory, exist_ok=True)
+
+        timestamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        label = re.sub(r"[^A-Za-z0-9_.-]+", "_", profile.label).strip("_") or "profile"
+        profile_id = timestamp + "-" + label + "-" + profile.mode + ".folded"
+
+        with open(os.path.join(self.directory, profile_id), "w") as file:
+            for stack, count in stacks.most_common():
+                if count:
+                    file.write(stack + " " + str(count) + "\n")
+
+        self._prune()
+        return profile_id
+
+    def _prune(self):
+        profile_ids = self.list()
+        for profile_id in profile_ids[self.keep:]:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(self.directory, profile_id))
+
+    def list(self):
+        if not os.path.isdir(self.directory):
+            return []
+
+        return sorted([filename for filename in os.listdir(self.directory) if filename.endswith(".folded")],
+                      reverse=True)
+
+    def path(self, profile_id):
+        if profile_id not in self.list():
+            return None
+
+        return os.path.join(self.directory, profile_id)
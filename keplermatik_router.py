@@ -0,0 +1,171 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+# Front end for sharded mode.  Serves the prediction and catalog endpoints by routing to the keplermatik_cluster
+# workers instead of holding the catalog itself.  The workers load from the offline caches in the working
+# directory; /admin/refresh/ (enabled by KEPLERMATIK_ADMIN=1) has them reload, first downloading fresh caches unless
+# KEPLERMATIK_OFFLINE is set.
+#
+#   KEPLERMATIK_SHARDS=8 uvicorn keplermatik_router:app --port 8001
+
+import asyncio
+import os
+from typing import List
+
+import keplermatik_encoding as encoding
+from keplermatik_cluster import Router
+from keplermatik_satellites import Satellites
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+shards = int(os.environ.get("KEPLERMATIK_SHARDS", str(os.cpu_count() or 1)))
+offline = os.environ.get("KEPLERMATIK_OFFLINE", "1") != "0"
+admin_enabled = os.environ.get("KEPLERMATIK_ADMIN", "0") == "1"
+
+MAXIMUM_BATCH_PREDICTIONS = 1000
+
+app = FastAPI()
+router = Router()
+
+# callers that arrive while a refresh is running wait for that one instead of queueing another
+refresh_task = None
+
+
+class PredictionRequest(BaseModel):
+    norad_cat_id: int
+    observer_latitude: float
+    observer_longitude: float
+
+
+def negotiated_media_type(request):
+    media_type = encoding.negotiate(request.headers.get("accept"))
+    if media_type is None:
+        raise HTTPException(status_code=406,
+                            detail="Supported media types: " + ", ".join(encoding.available_media_types()))
+
+    return media_type
+
+
+async def in_executor(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+@app.on_event("startup")
+async def start_cluster():
+    await in_executor(router.start, shards)
+
+
+@app.on_event("shutdown")
+async def stop_cluster():
+    await in_executor(router.stop)
+
+
+@app.post("/predict_now/")
+async def predict_now(prediction_request: PredictionRequest, request: Request):
+    media_type = negotiated_media_type(request)
+
+    prediction = await in_executor(router.predict, prediction_request.norad_cat_id,
+                                   prediction_request.observer_latitude, prediction_request.observer_longitude)
+    if prediction["latitude"] is None:
+        raise HTTPException(status_code=404, detail="Unknown norad_cat_id " + str(prediction_request.norad_cat_id))
+
+    return Response(content=encoding.encode_prediction(prediction, media_type), media_type=media_type)
+
+
+@app.post("/predict_batch/")
+async def predict_batch(prediction_requests: List[PredictionRequest], request: Request):
+    media_type = negotiated_media_type(request)
+
+    if len(prediction_requests) > MAXIMUM_BATCH_PREDICTIONS:
+        raise HTTPException(status_code=400,
+                            detail="At most " + str(MAXIMUM_BATCH_PREDICTIONS) + " predictions per request")
+
+    predictions = await in_executor(router.predict_batch,
+                                    [(prediction_request.norad_cat_id, prediction_request.observer_latitude,
+                                      prediction_request.observer_longitude)
+                                     for prediction_request in prediction_requests])
+
+    return Response(content=encoding.encode_predictions(predictions, media_type), media_type=media_type)
+
+
+@app.get("/satellites_by_norad_cat_id/")
+async def satellites_by_norad_cat_id():
+    return {norad_cat_id: name.upper() for norad_cat_id, name in await in_executor(router.catalog)}
+
+
+@app.get("/satellites_by_name/")
+async def satellites_by_name():
+    return {name.upper(): norad_cat_id for norad_cat_id, name in await in_executor(router.catalog)}
+
+
+@app.get("/cluster/")
+async def cluster_status():
+    return router.status
+
+
+@app.post("/cluster/workers/")
+async def add_worker():
+    worker_id = await in_executor(router.add_worker)
+    return {"worker_id": worker_id, **router.status}
+
+
+@app.delete("/cluster/workers/{worker_id}")
+async def remove_worker(worker_id: int):
+    try:
+        await in_executor(router.remove_worker, worker_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown worker " + str(worker_id))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return router.status
+
+
+def require_admin():
+    if not admin_enabled:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+
+
+@app.post("/admin/refresh/")
+async def refresh_satellites():
+    global refresh_task
+    require_admin()
+
+    if refresh_task is None or refresh_task.done():
+        refresh_task = asyncio.ensure_future(reload_cluster())
+
+    # shielded so a caller hanging up doesn't cancel the refresh the others are waiting on
+    return await asyncio.shield(refresh_task)
+
+
+async def reload_cluster():
+    if not offline:
+        # rewrites the caches the workers read; the catalog it builds along the way isn't needed here
+        await in_executor(Satellites, False)
+
+    return await in_executor(router.refresh)
@@ -25,159 +25,254 @@
 #     exception statement from all source files in the program, then also delete
 #     it in the license file.
 
+import collections
+import datetime
 import json
 import os
+import time
 
 import numpy as np
-import pickle
-import re
-import warnings
 
-import skyfield.positionlib
+from sgp4.api import Satrec, SatrecArray, jday
 from skyfield.api import EarthSatellite, load, wgs84
 
+import keplermatik_metrics as metrics
 import satnogs_network
 from keplermatik_transmitters import Transmitters
 
 
 class Satellites(dict):
 
-    def __init__(self):
+    # norad_cat_ids limits an offline load to part of the catalog, for shard workers in keplermatik_cluster
+
+    def __init__(self, offline=True, norad_cat_ids=None):
         super(Satellites, self).__init__()
-        self.offline_flag = True
+        self.offline_flag = offline
         self.tle_source = ""
         self.cleaned_up_satellites = []
         self.not_found_satellites = []
         self.satnogs_tle_satellites = []
+        self.stage_timings = {}
 
-        current_tles = ""
-
+        start = time.perf_counter()
         satnogs = satnogs_network.SatnogsClient(self)
 
         if not self.offline_flag:
-            satnogs.get_satellites()
+            # the downloads overlap each other and the parsing; the SatNOGS TLE lookups for satellites CelesTrak
+            # doesn't have need the parsed catalog, so they and the TLE file writes are stages of their own
+            with metrics.stage("fetch", self.stage_timings):
+                downloaded = satnogs.fetch_catalog()
+
+            if downloaded:
+                satnogs.update_tles(celestrak_downloaded=True)
+
             self.tle_source = "tle.txt"
             self.cleanup_satellites()
 
-            for norad_cat_id, satellite in self.items():
-                current_tles += satellite.tle.tle_lines[0] + "\r\n" + \
-                                satellite.tle.tle_lines[1] + "\r\n" + \
-                                satellite.tle.tle_lines[2] + "\r\n"
+            with metrics.stage("write_tle_cache", self.stage_timings):
+                current_tles = "".join(line + "\r\n" for satellite in self.values() for line in satellite.tle.tle_lines)
 
-            with open('tle_cache.txt', 'wb') as file:
-                file.write(bytes(current_tles, "UTF-8"))
+                with open('tle_cache.txt', 'wb') as file:
+                    file.write(bytes(current_tles, "UTF-8"))
         else:
-            satnogs.get_satellites(offline=True)
+            with metrics.stage("parse_cache", self.stage_timings):
+                satnogs.get_satellites(offline=True)
+
             self.tle_source = "tle_cache.txt"
+
+            if norad_cat_ids is not None:
+                norad_cat_ids = set(norad_cat_ids)
+                self.remove_satellites([norad_cat_id for norad_cat_id in self if norad_cat_id not in norad_cat_ids])
+
             self.cleanup_satellites()
 
-        print("LOADING TLEs | " + str(len(self)) + " SATELLITES")
-        for norad_cat_id, satellite in self.items():
-            satellite.load_tle(self.tle_source)
+            # cleanup from the cache already took out everything known to be invalid, so this is just the TLE lookup
+            with metrics.stage("load_tles", self.stage_timings):
+                print("LOADING TLEs | " + str(len(self)) + " SATELLITES")
+                tles = tle_index(self.tle_source)
+                for satellite in self.values():
+                    satellite.tle.load_from_index(tles)
+
+                self.remove_satellites([norad_cat_id for norad_cat_id, satellite in self.items()
+                                        if not satellite.tle.exists])
+
+        print("CATALOG READY | " + str(len(self)) + " SATELLITES | " + "%.3f" % (time.perf_counter() - start) + " s")
 
     def get_by_name(self, name):
         by_name = {sat.name: sat for sat in self.items()}
         satellite = by_name[name]
         print(satellite)
 
+    def remove_satellites(self, norad_cat_ids):
+        for norad_cat_id in {int(norad_cat_id) for norad_cat_id in norad_cat_ids} & self.keys():
+            del self[norad_cat_id]
+
     def cleanup_satellites(self):
-        satellites_to_delete = []
-        no_tle_count = 0
-        not_orbiting_count = 0
+        with metrics.stage("cleanup", self.stage_timings):
+            if self.offline_flag == 1:
+                if os.path.isfile('cleanup_cache'):
+                    with open('cleanup_cache', ) as fp:
+                        satellites_to_delete = json.load(fp)
 
-        if self.offline_flag == 1:
-            if os.path.isfile('cleanup_cache'):
-                with open('cleanup_cache', ) as fp:
-                    satellites_to_delete = json.load(fp)
+                    print("CLEANING UP INVALID SATELLITES | " + str(len(satellites_to_delete)) + " INVALID SATELLITES IN CACHE")
 
-                print("CLEANING UP INVALID SATELLITES | " + str(len(satellites_to_delete)) + " INVALID SATELLITES IN CACHE")
+                    self.remove_satellites(satellites_to_delete)
 
-                for satellite_to_delete in satellites_to_delete:
-                    for satellite in [satellite for satellite in self if satellite == satellite_to_delete]: del (
-                        self[int(satellite_to_delete)])
+            else:
+                print("CLEANING UP INVALID SATELLITES | ANALYZING " + str(len(self)) + " SATELLITES")
 
-        else:
-            print("CLEANING UP INVALID SATELLITES | ANALYZING " + str(len(self)) + " SATELLITES")
+                tles = tle_index(self.tle_source)
+                no_tle = []
+                for norad_cat_id, satellite in self.items():
+                    satellite.tle.load_from_index(tles)
+                    if not satellite.tle.exists:
+                        no_tle.append(norad_cat_id)
 
-            for norad_cat_id, satellite in self.items():
-                satellite.load_tle(self.tle_source)
-                if not satellite.tle.exists:
-                    satellites_to_delete.append(norad_cat_id)
-                    no_tle_count = no_tle_count + 1
-                    self.cleaned_up_satellites.append(norad_cat_id)
+                not_orbiting = not_orbiting_satellites([satellite for satellite in self.values()
+                                                        if satellite.tle.exists])
 
-            for satellite_to_delete in satellites_to_delete:
-                for satellite in [satellite for satellite in self if satellite == satellite_to_delete]:
-                    del self[int(satellite_to_delete)]
+                satellites_to_delete = no_tle + not_orbiting
+                self.cleaned_up_satellites.extend(satellites_to_delete)
 
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
+                with open('cleanup_cache', 'w') as fp:
+                    json.dump(satellites_to_delete, fp)
 
-                for norad_cat_id, satellite in self.items():
-                    satellite.update_current_prediction()
+                self.remove_satellites(satellites_to_delete)
 
-                    if wgs84.height_of(satellite.geocentric).m <= 0:
-                        satellites_to_delete.append(norad_cat_id)
-                        self.cleaned_up_satellites.append(norad_cat_id)
-                        not_orbiting_count = not_orbiting_count + 1
+                print("CLEANED UP " + str(len(satellites_to_delete)) + " SATELLITES | " + str(
+                    len(no_tle)) + " WITHOUT TLE / " + str(len(not_orbiting)) + " NOT ORBITING")
 
-            with open('cleanup_cache', 'w') as fp:
-                json.dump(satellites_to_delete, fp)
 
-            for satellite_to_delete in satellites_to_delete:
-                for satellite in [satellite for satellite in self if satellite == satellite_to_delete]: del (
-                    self[int(satellite_to_delete)])
+def not_orbiting_satellites(satellites):
+    # propagates every satellite to now in a single SatrecArray call and returns the ids of those whose elements
+    # don't propagate or put them at or below the WGS84 ellipsoid
+    norad_cat_ids = []
+    invalid = []
+    satrecs = []
 
-            print("CLEANED UP " + str(no_tle_count + not_orbiting_count) + " SATELLITES | " + str(
-                no_tle_count) + " WITHOUT TLE / " + str(not_orbiting_count) + " NOT ORBITING")
+    for satellite in satellites:
+        try:
+            satrecs.append(Satrec.twoline2rv(satellite.tle.tle_lines[1], satellite.tle.tle_lines[2]))
+            norad_cat_ids.append(satellite.norad_cat_id)
+        except (ValueError, IndexError):
+            invalid.append(satellite.norad_cat_id)
 
-            with open('satellite_cache', 'wb') as fp:
-                pickle.dump(satellites_to_delete, fp)
+    if not satrecs:
+        return invalid
 
+    now = datetime.datetime.now(datetime.timezone.utc)
+    jd, fr = jday(now.year, now.month, now.day, now.hour, now.minute, now.second + now.microsecond / 1e6)
+    errors, positions, _ = SatrecArray(satrecs).sgp4(np.array([jd]), np.array([fr]))
+    errors = errors[:, 0]
+    positions = positions[:, 0, :]
 
-class Prediction:
+    # height above the ellipsoid along the geocentric radius, which is all a "below the surface" test needs
+    a = 6378.137
+    b = 6356.752314245
+    radius = np.linalg.norm(positions, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sin_latitude = positions[:, 2] / radius
+        cos_latitude = np.sqrt(1 - sin_latitude ** 2)
+        height = radius - a * b / np.sqrt((b * cos_latitude) ** 2 + (a * sin_latitude) ** 2)
+
+        not_orbiting = (errors != 0) | ~(height > 0)
+
+    return invalid + [norad_cat_id for norad_cat_id, flag in zip(norad_cat_ids, not_orbiting) if flag]
+
+
+_tle_indexes = {}
+
+
+def tle_index(filename):
+    # norad_cat_id -> [name, line 1, line 2] for every TLE in filename; parsed once per version of the file, so
+    # looking up one satellite no longer means scanning the whole file
+    stat = os.stat(filename)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _tle_indexes.get(os.path.abspath(filename))
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with metrics.tle_parse_seconds.time():
+        with open(filename, 'r') as file:
+            lines = file.read().splitlines()
+
+        index = {}
+        for i in range(len(lines) - 1):
+            line1 = lines[i]
+            line2 = lines[i + 1]
+            if not (line1.startswith("1 ") and line2.startswith("2 ")):
+                continue
+
+            try:
+                norad_cat_id = int(line1[2:7])
+            except ValueError:
+                continue
+
+            # the first TLE for an id wins, as it did when files were searched
+            if norad_cat_id not in index:
+                index[norad_cat_id] = [lines[i - 1].rstrip() if i > 0 else "", line1.rstrip(), line2.rstrip()]
+
+    _tle_indexes[os.path.abspath(filename)] = (version, index)
+    return index
 
-    def __init__(self):
-        self.timescale = None
-        self.range_rate = 0
-        self.norad_cat_id = 0
-        self.elevation = 0
-        self.geocentric = skyfield.positionlib.Geocentric([0.0, 0.0, 0.0])
-        self.latitude = 0.0
-        self.longitude = 0.0
-        self.altitude = 0.0
-        self.position = 0.0
-        self.elevation = 0.0
-        self.azimuth = 0.0
-        self.range = 0.0
-        self.speed = 0.0
-        self.velocity = [0.0, 0.0, 0.0]
+
+# Prediction results are immutable and carry no references back to the Satellite, so any number of threads or
+# processes can predict against the same catalog at once.
+
+SatellitePosition = collections.namedtuple("SatellitePosition",
+                                           ["norad_cat_id", "time", "latitude", "longitude", "altitude"])
+
+CulminationPrediction = collections.namedtuple("CulminationPrediction", ["time", "elevation", "azimuth"])
+
+PassPrediction = collections.namedtuple("PassPrediction",
+                                        ["norad_cat_id", "rise_time", "set_time", "maximum_elevation",
+                                         "culminations"])
+
+
+class ObserverPrediction(collections.namedtuple("ObserverPrediction",
+                                                ["norad_cat_id", "time", "latitude", "longitude", "altitude",
+                                                 "elevation", "azimuth", "range", "range_rate", "speed"])):
+    __slots__ = ()
+
+    @property
+    def doppler_per_hz(self):
+        c = 299792.458
+        return -(self.range_rate / c)
+
+
+def unknown_prediction_summary(norad_cat_id):
+    # stands in for Satellite.prediction_summary in batch results for ids that aren't in the catalog
+    return {"norad_cat_id": norad_cat_id, "latitude": None, "longitude": None, "rise_time": "", "set_time": "",
+            "maximum_elevation": None}
+
+
+# searches resuming at a pass's rise start this far before it, so the rise itself falls inside the window
+RESUME_MARGIN_DAYS = 1.0 / 1440.0
+
+_timescale = None
+
+
+def timescale():
+    global _timescale
+
+    if _timescale is None:
+        _timescale = load.timescale()
+
+    return _timescale
 
 
 class Satellite(object):
 
     def __init__(self, data):
 
-        self.sat = None
         self.name = ""
-        self.range_rate = 0
         self.transmitters = Transmitters()
-        self.elevation = 0
         self.norad_cat_id = 0
-        self.geocentric = None
-        self.latitude = None
-        self.longitude = None
-        self.altitude = 0.0
-        self.position = 0.0
-        self.elevation = 0.0
-        self.azimuth = 0.0
-        self.range = 0.0
-        self.speed = 0.0
-        self.velocity = []
 
         self.current_time_resolution = 1
 
-        self.passes = []
+        self._earth_satellite = None
 
         # This and _wrap allow the user to access any SATNOGS data as part of the Satellite object by wrapping the
         # SATNOGS object parameters.
@@ -201,17 +296,179 @@ class Satellite(object):
         return self.tle.exists
 
     @property
-    def doppler_per_hz(self):
-        c = 299792.458
-        return -(self.range_rate / c)
+    def earth_satellite(self):
+        # built once per TLE rather than once per prediction; the lines are stored alongside so a reloaded TLE
+        # is picked up, and the pair is swapped in as one tuple so concurrent readers never see a mismatch
+        tle_lines = tuple(self.tle.tle_lines)
+
+        if self._earth_satellite is None or self._earth_satellite[0] != tle_lines:
+            self._earth_satellite = (tle_lines, EarthSatellite(tle_lines[1], tle_lines[2], self.name))
+
+        return self._earth_satellite[1]
+
+    def propagate(self, t):
+        with metrics.propagation_seconds.time():
+            geocentric = self.earth_satellite.at(t)
+            subpoint = wgs84.geographic_position_of(geocentric)
+
+        return SatellitePosition(norad_cat_id=self.norad_cat_id,
+                                 time=t.utc_iso(),
+                                 latitude=float(subpoint.latitude.degrees),
+                                 longitude=float(subpoint.longitude.degrees),
+                                 altitude=float(subpoint.elevation.m))
+
+    def observe(self, t, observer_latitude=0.0, observer_longitude=0.0):
+        position = self.propagate(t)
+
+        with metrics.topocentric_seconds.time():
+            here = wgs84.latlon(observer_latitude, observer_longitude)
+            topocentric = (self.earth_satellite - here).at(t)
+            obs_elevation, obs_azimuth, obs_range = topocentric.altaz()
+
+            relative_position = topocentric.position.km
+            relative_velocity = topocentric.velocity.km_per_s
+            range_rate = float(np.dot(relative_position, relative_velocity) / np.linalg.norm(relative_position))
+
+        return ObserverPrediction(norad_cat_id=self.norad_cat_id,
+                                  time=position.time,
+                                  latitude=position.latitude,
+                                  longitude=position.longitude,
+                                  altitude=position.altitude,
+                                  elevation=float(obs_elevation.degrees),
+                                  azimuth=float(obs_azimuth.degrees),
+                                  range=float(obs_range.km),
+                                  range_rate=range_rate,
+                                  speed=float(topocentric.speed().km_per_s))
+
+    def ephemeris(self, unix_times, observer_latitude=None, observer_longitude=None):
+        # vectorized propagation over an array of unix timestamps, returned as columns of numpy arrays
+        unix_times = np.atleast_1d(np.asarray(unix_times, dtype=float))
+        t = timescale().utc(1970, 1, 1, 0, 0, unix_times)
+
+        with metrics.propagation_seconds.time():
+            subpoint = wgs84.geographic_position_of(self.earth_satellite.at(t))
+
+        columns = {"time": unix_times,
+                   "latitude": subpoint.latitude.degrees,
+                   "longitude": subpoint.longitude.degrees,
+                   "altitude": subpoint.elevation.m}
+
+        if observer_latitude is not None and observer_longitude is not None:
+            with metrics.topocentric_seconds.time():
+                here = wgs84.latlon(observer_latitude, observer_longitude)
+                topocentric = (self.earth_satellite - here).at(t)
+                obs_elevation, obs_azimuth, obs_range = topocentric.altaz()
+
+                relative_position = topocentric.position.km
+                relative_velocity = topocentric.velocity.km_per_s
+                range_rate = np.einsum("ij,ij->j", relative_position, relative_velocity) / \
+                    np.linalg.norm(relative_position, axis=0)
+
+            columns.update({"elevation": obs_elevation.degrees,
+                            "azimuth": obs_azimuth.degrees,
+                            "range": obs_range.km,
+                            "range_rate": range_rate})
+
+        return columns
+
+    def find_passes(self, t_start, t_finish, observer_latitude, observer_longitude, minimum_elevation=0.0):
+        return self.search_passes(t_start, t_finish, observer_latitude, observer_longitude, minimum_elevation)[0]
+
+    @metrics.pass_search_seconds.timed()
+    def search_passes(self, t_start, t_finish, observer_latitude, observer_longitude, minimum_elevation=0.0):
+        # The passes that set between t_start and t_finish, and where a later search has to start to see the pass
+        # still in progress at t_finish from its rise: a little before that rise, t_start if the satellite was up
+        # for the whole window, or None if it is below minimum_elevation at t_finish.
+        #
+        # 0 — Satellite rose above ``altitude_degrees``.
+        # 1 — Satellite culminated and started to descend again.
+        # 2 — Satellite fell below ``altitude_degrees``.
+        here = wgs84.latlon(observer_latitude, observer_longitude)
+        event_times, event_types = self.earth_satellite.find_events(here, t_start, t_finish,
+                                                                    altitude_degrees=minimum_elevation)
+
+        if len(event_types) == 0:
+            up = (self.earth_satellite - here).at(t_finish).altaz()[0].degrees >= minimum_elevation
+            return (), (t_start if up else None)
+
+        resume = None
+        rises = np.flatnonzero(event_types == 0)
+        sets = np.flatnonzero(event_types == 2)
+        if len(rises) and (not len(sets) or rises[-1] > sets[-1]):
+            resume = event_times[rises[-1]] - RESUME_MARGIN_DAYS
+        elif not len(rises) and not len(sets):
+            # only culminations: up for the whole window
+            resume = t_start
+
+        # every culmination is looked up in one vectorized call instead of one prediction per event
+        culmination_indexes = np.flatnonzero(event_types == 1)
+        if len(culmination_indexes):
+            culmination_times = event_times[culmination_indexes]
+            elevations, azimuths, _ = (self.earth_satellite - here).at(culmination_times).altaz()
+            culmination_elevations = elevations.degrees
+            culmination_azimuths = azimuths.degrees
+
+        event_isos = event_times.utc_iso()
+
+        passes = []
+        rise_time = ""
+        culminations = []
+        culmination = 0
+
+        for i, event_type in enumerate(event_types):
+
+            if event_type == 0:
+                rise_time = event_isos[i]
+
+            elif event_type == 1:
+                culminations.append(CulminationPrediction(time=event_isos[i],
+                                                          elevation=float(culmination_elevations[culmination]),
+                                                          azimuth=float(culmination_azimuths[culmination])))
+                culmination += 1
+
+            elif event_type == 2:
+                passes.append(PassPrediction(norad_cat_id=self.norad_cat_id,
+                                             rise_time=rise_time,
+                                             set_time=event_isos[i],
+                                             maximum_elevation=max([c.elevation for c in culminations],
+                                                                   default=0.0),
+                                             culminations=tuple(culminations)))
+                rise_time = ""
+                culminations = []
+
+        return tuple(passes), resume
+
+    def pass_search_start(self, t, observer_latitude, observer_longitude, minimum_elevation=0.0):
+        # where a search for passes from t has to start so a pass already in progress at t is found from its rise;
+        # looks back at most one orbit, beyond which the satellite never sets for this observer
+        period_days = 2 * np.pi / self.earth_satellite.model.no_kozai / 1440.0
+        passes, resume = self.search_passes(t - period_days, t, observer_latitude, observer_longitude,
+                                            minimum_elevation)
+
+        return t if resume is None else resume
+
+    def next_pass(self, t, observer_latitude, observer_longitude, minimum_elevation=0.0, days=1.0):
+        passes = self.find_passes(t, t + days, observer_latitude, observer_longitude, minimum_elevation)
+        return passes[0] if passes else None
+
+    def prediction_summary(self, observer_latitude, observer_longitude):
+        # where the satellite is now and its next pass over the observer, as served by /predict_now/
+        now = timescale().now()
+        position = self.propagate(now)
+        next_pass = self.next_pass(now, observer_latitude, observer_longitude)
+
+        return {"norad_cat_id": self.norad_cat_id,
+                "latitude": position.latitude,
+                "longitude": position.longitude,
+                "rise_time": next_pass.rise_time if next_pass is not None else "",
+                "set_time": next_pass.set_time if next_pass is not None else "",
+                "maximum_elevation": next_pass.maximum_elevation if next_pass is not None else None}
 
     def predict_now(self, observer_latitude, observer_longitude):
-        ts = load.timescale()
-        timescale = ts.now()
-        self.predict(timescale, observer_latitude, observer_longitude)
+        return self.predict(timescale().now(), observer_latitude, observer_longitude)
 
     def predict_gmtime(self, this_gmtime):
-        ts = load.timescale()
+        ts = timescale()
         # utc(self, year, month=1, day=1, hour=0, minute=0, second=0.0):
         hours = np.arange(0, 23, 1 / 60)
         # minutes = np.arange(0, 2, (1))
@@ -225,8 +482,8 @@ class Satellite(object):
         pass
 
     def find_events(self):
-        sat = EarthSatellite(self.tle.tle_lines[1], self.tle.tle_lines[2], self.name)
-        ts = load.timescale()
+        sat = self.earth_satellite
+        ts = timescale()
 
         bluffton = wgs84.latlon(+40.8939, -83.8917)
         t0 = ts.utc(2022, 7, 4)
@@ -236,125 +493,17 @@ class Satellite(object):
             name = ('rise above 30°', 'culminate', 'set below 30°')[event]
             # print(ti.utc_jpl(), name)
 
-    def predict_observer(self, prediction, observer_latitude, observer_longitude):
-
-        here = wgs84.latlon(observer_latitude, observer_longitude)
-        difference = prediction.sat - here
-        topocentric = difference.at(prediction.timescale)
-        prediction.position = list(topocentric.position.km)
-        obs_elevation, obs_azimuth, obs_range = topocentric.altaz()
-        prediction.elevation = float(obs_elevation.degrees)
-        prediction.azimuth = float(obs_azimuth.degrees)
-        prediction.range = float(obs_range.km)
-        prediction.speed = float(topocentric.speed().km_per_s)
-        prediction.velocity = list(topocentric.velocity.km_per_s)
-
-        prediction.range_rate = float((prediction.velocity[0] * prediction.position[0] +
-                                       prediction.velocity[1] * prediction.position[1] +
-                                       prediction.velocity[2] * prediction.position[2]) /
-                                      ((prediction.position[0] ** 2 + prediction.position[1] ** 2 + prediction.position[2] ** 2) ** .5))
-
-        # for uuid, transmitter in self.transmitters.items():
-        #     transmitter.range_rate = self.range_rate
-
-        return prediction
-
-    def predict_satellite(self, tscale):
-        prediction = Prediction()
-        prediction.timescale = tscale
-
-        prediction.sat = EarthSatellite(self.tle.tle_lines[1], self.tle.tle_lines[2], self.name)
-        geocentric = prediction.sat.at(tscale)
-
-        prediction.geocentric = geocentric
-        subpoint = geocentric.subpoint()
-
-        prediction.latitude = float(subpoint.latitude.degrees)
-        prediction.longitude = float(subpoint.longitude.degrees)
-        prediction.altitude = float(subpoint.elevation.m)
-
-        for uuid, transmitter in self.transmitters.items():
-            transmitter.range_rate = self.range_rate
-
-        return prediction
-
-    # todo:  make so no lat long results in just running predict_satellite
+    # todo:  make so no lat long results in just running propagate
     def predict(self, t_scale, observer_latitude=0.0, observer_longitude=0.0):
-        sat_prediction = self.predict_satellite(t_scale)
-        prediction = self.predict_observer(sat_prediction, observer_latitude, observer_longitude)
-        return prediction
-
-    def update_current_prediction(self):
-        # todo:  manage observers
-
-        ts = load.timescale()
-        timescale = ts.now()
-        prediction = self.predict(timescale)
-
-        for key in prediction.__dict__.keys():
-            setattr(self, key, getattr(prediction, key))
+        return self.observe(t_scale, observer_latitude, observer_longitude)
 
     def predict_passes(self, tscale_start, tscale_finish, minimum_elevation, observer_longitude, observer_latitude):
-        event_types = ["rise", "culmination", "set"]
-        t_tomorrow = tscale_start + 1
-
-        # 0 — Satellite rose above ``altitude_degrees``.
-        # 1 — Satellite culminated and started to descend again.
-        # 2 — Satellite fell below ``altitude_degrees``.
-        sat = EarthSatellite(self.tle.tle_lines[1], self.tle.tle_lines[2], self.name)
-        here = wgs84.latlon(observer_latitude, observer_longitude)
-        sat_events = sat.find_events(here, tscale_start, tscale_finish, altitude_degrees=minimum_elevation)
-
-        event_types = sat_events[1]
-        event_times = sat_events[0]
-
-        satellite_pass = SatellitePass()
-
-        for i, event_type in enumerate(event_types):
-
-            if event_type == 0:
-                satellite_pass.rise_time = event_times[i].utc_iso()
-
-            elif event_type == 1:
-                culmination = Culmination()
-
-                prediction = self.predict(event_times[i], observer_latitude, observer_longitude)
-
-                culmination.time = event_times[i].utc_iso()
-                culmination.elevation = prediction.elevation
-                culmination.azimuth = prediction.azimuth
-
-                if prediction.elevation > satellite_pass.maximum_elevation:
-                    satellite_pass.maximum_elevation = prediction.elevation
-
-                satellite_pass.culimnations.append(event_times[i].utc_iso())
-
-            elif event_type == 2:
-                satellite_pass.set_time = event_times[i].utc_iso()
-                self.passes.append(satellite_pass)
-
-                satellite_pass = SatellitePass()
+        return self.find_passes(tscale_start, tscale_finish, observer_latitude, observer_longitude, minimum_elevation)
 
     def __repr__(self):
         return str(self.__dict__)
 
 
-# todo:  set up defaults for params, optional params
-class SatellitePass:
-    def __init__(self):
-        self.rise_time = ""
-        self.set_time = ""
-        self.culimnations = []
-        self.maximum_elevation = 0.0
-
-
-class Culmination:
-    def __init__(self):
-        self.time = ""
-        self.elevation = 0.0
-        self.azimuth = 0.0
-
-
 class TLE:
 
     def __init__(self, norad_cat_id):
@@ -364,14 +513,28 @@ class TLE:
         self.norad_cat_id = norad_cat_id
         self.filename = ""
 
+    @property
+    def epoch(self):
+        # columns 19-32 of line 1 hold the epoch as a two digit year and fractional day of year
+        if not self.exists:
+            return None
+
+        year = int(self.tle_lines[1][18:20])
+        year += 2000 if year < 57 else 1900
+        day = float(self.tle_lines[1][20:32])
+        return datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=day - 1)
+
     def load_tle(self, filename):
-        with open(filename, 'r') as file:
-            tle_file_contents = file.read()
-            re_string = "\n(.*\n1.*" + str(self.norad_cat_id) + "[UCS].*\n.*)"
-            self.tle_text = re.findall(re_string, tle_file_contents)
+        self.load_from_index(tle_index(filename))
 
-            if (self.tle_text):
-                self.tle_lines = self.tle_text[0].split("\n")
-                self.exists = True
-            else:
-                self.exists = False
+    def load_from_index(self, index):
+        tle_lines = index.get(self.norad_cat_id)
+
+        if tle_lines is not None:
+            self.tle_lines = list(tle_lines)
+            self.tle_text = ["\n".join(tle_lines)]
+            self.exists = True
+        else:
+            self.tle_lines = []
+            self.tle_text = []
+            self.exists = False
@@ -0,0 +1,225 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+# Rolling pass schedules for registered ground stations.  Each station keeps the passes of its satellites over the
+# next horizon_days in memory.  advance() drops passes that have ended and searches only the new tail of the window,
+# update_catalog() re-searches only satellites whose TLE changed, and reads return a prebuilt tuple.
+#
+# A pass is only recorded once it has set inside a searched window.  For every satellite the schedule remembers
+# where its next search has to start: the old horizon, or just before the rise of a pass that was still in progress
+# there, so that pass is found whole however long it lasts.  First searches start at the rise of a pass already in
+# progress for the same reason.
+#
+# All updates run under one lock on a worker thread; readers never take the lock, they just pick up whichever
+# schedule tuple was last swapped in.  A new station's first whole-window search is the exception: it fills a
+# schedule nothing else touches yet, so it runs outside the lock and only the swap into place takes it.
+
+import threading
+
+from keplermatik_satellites import timescale
+
+SECONDS_PER_DAY = 86400.0
+
+
+class Station:
+
+    def __init__(self, station_id, latitude, longitude, minimum_elevation=0.0, norad_cat_ids=None):
+        self.station_id = station_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.minimum_elevation = minimum_elevation
+        # None tracks every satellite in the catalog, an empty collection tracks none
+        self.norad_cat_ids = frozenset(norad_cat_ids) if norad_cat_ids is not None else None
+
+    def tracks(self, norad_cat_id):
+        return self.norad_cat_ids is None or norad_cat_id in self.norad_cat_ids
+
+
+class StationSchedule:
+
+    def __init__(self, station):
+        self.station = station
+        self.ready = False
+        self.error = None
+        self.horizon = None
+
+        # norad_cat_id -> passes sorted by rise time, the TLE lines they were computed from and where the next
+        # search for the satellite starts
+        self.satellite_passes = {}
+        self.tle_lines = {}
+        self.search_from = {}
+
+        # every pass for the station sorted by rise time, rebuilt whenever satellite_passes changes
+        self.passes = ()
+        self.updated = None
+
+    def rebuild(self):
+        self.passes = tuple(sorted((satellite_pass for satellite_passes in self.satellite_passes.values()
+                                    for satellite_pass in satellite_passes),
+                                   key=lambda satellite_pass: satellite_pass.rise_time))
+        self.updated = timescale().now().utc_iso()
+
+
+class PassScheduler:
+
+    def __init__(self, satellites, horizon_days=2.0):
+        self.satellites = satellites
+        self.horizon_days = horizon_days
+
+        self.schedules = {}
+        self._lock = threading.Lock()
+
+    def register(self, station):
+        return self.fill(self.add(station))
+
+    def add(self, station):
+        # an empty schedule for station, not ready until fill() has run
+        schedule = StationSchedule(station)
+        self.schedules[station.station_id] = schedule
+        return schedule
+
+    def fill(self, schedule):
+        # the first search over the whole window; a failure is kept on the schedule for status reads
+        try:
+            satellites = self.satellites
+            now = timescale().now()
+            horizon = now + self.horizon_days
+            for norad_cat_id, satellite in satellites.items():
+                if schedule.station.tracks(norad_cat_id) and satellite.tle.exists:
+                    self._search_from_now(schedule, satellite, now, horizon)
+
+            with self._lock:
+                # the catalog may have been refreshed while the search ran
+                if self.satellites is not satellites:
+                    self._reconcile(schedule, self.satellites, now)
+
+                self._expire(schedule, now.utc_iso())
+                schedule.horizon = horizon
+                schedule.rebuild()
+                schedule.ready = True
+
+        except Exception as e:
+            schedule.error = repr(e)
+            raise
+
+        return schedule
+
+    def unregister(self, station_id):
+        with self._lock:
+            return self.schedules.pop(station_id, None) is not None
+
+    def passes(self, station_id):
+        schedule = self.schedules.get(station_id)
+        return None if schedule is None else schedule.passes
+
+    def advance(self):
+        now = timescale().now()
+        now_iso = now.utc_iso()
+        horizon = now + self.horizon_days
+
+        with self._lock:
+            for schedule in list(self.schedules.values()):
+                if not schedule.ready:
+                    continue
+
+                self._expire(schedule, now_iso)
+
+                for norad_cat_id in list(schedule.tle_lines):
+                    satellite = self.satellites.get(norad_cat_id)
+                    if satellite is None:
+                        continue
+
+                    self._search(schedule, satellite, schedule.search_from.get(norad_cat_id, schedule.horizon),
+                                 horizon)
+
+                schedule.horizon = horizon
+                schedule.rebuild()
+
+    def update_catalog(self, satellites):
+        # swaps in a refreshed catalog, re-searching only satellites that are new or whose TLE changed
+        now = timescale().now()
+
+        with self._lock:
+            self.satellites = satellites
+
+            for schedule in list(self.schedules.values()):
+                if not schedule.ready:
+                    continue
+
+                if self._reconcile(schedule, satellites, now):
+                    self._expire(schedule, now.utc_iso())
+                    schedule.rebuild()
+
+    def _reconcile(self, schedule, satellites, now):
+        # brings schedule in line with satellites, returning whether anything changed
+        station = schedule.station
+        horizon = schedule.horizon if schedule.horizon is not None else now + self.horizon_days
+        changed = False
+
+        for norad_cat_id in [norad_cat_id for norad_cat_id in schedule.tle_lines if norad_cat_id not in satellites]:
+            del schedule.tle_lines[norad_cat_id]
+            schedule.satellite_passes.pop(norad_cat_id, None)
+            schedule.search_from.pop(norad_cat_id, None)
+            changed = True
+
+        for norad_cat_id, satellite in satellites.items():
+            if not station.tracks(norad_cat_id) or not satellite.tle.exists:
+                continue
+            if schedule.tle_lines.get(norad_cat_id) == tuple(satellite.tle.tle_lines):
+                continue
+
+            schedule.satellite_passes.pop(norad_cat_id, None)
+            self._search_from_now(schedule, satellite, now, horizon)
+            changed = True
+
+        return changed
+
+    def _expire(self, schedule, now_iso):
+        for norad_cat_id, satellite_passes in list(schedule.satellite_passes.items()):
+            schedule.satellite_passes[norad_cat_id] = [satellite_pass for satellite_pass in satellite_passes
+                                                       if satellite_pass.set_time >= now_iso]
+
+    def _search_from_now(self, schedule, satellite, now, finish):
+        station = schedule.station
+        start = satellite.pass_search_start(now, station.latitude, station.longitude, station.minimum_elevation)
+        self._search(schedule, satellite, start, finish)
+
+    def _search(self, schedule, satellite, start, finish):
+        station = schedule.station
+        found, resume = satellite.search_passes(start, finish, station.latitude, station.longitude,
+                                                station.minimum_elevation)
+
+        satellite_passes = schedule.satellite_passes.setdefault(satellite.norad_cat_id, [])
+        last_set_time = satellite_passes[-1].set_time if satellite_passes else ""
+
+        # a satellite's passes don't overlap, so anything rising before the last recorded set was recorded already;
+        # passes already under way at start come back without a rise time and are skipped the same way
+        satellite_passes.extend(satellite_pass for satellite_pass in found
+                                if satellite_pass.rise_time and satellite_pass.rise_time > last_set_time)
+
+        schedule.tle_lines[satellite.norad_cat_id] = tuple(satellite.tle.tle_lines)
+        schedule.search_from[satellite.norad_cat_id] = finish if resume is None else resume
@@ -0,0 +1,159 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+# A local stand-in for db.satnogs.org and celestrak.com serving either a synthetic catalog or a directory of
+# recorded responses (satellites.json, transmitters.json and celestrak_tle.txt, as written by
+# benchmarks/synthetic_catalog.py or saved from a real run).  Point the service at it with
+# KEPLERMATIK_SATNOGS_URL and KEPLERMATIK_CELESTRAK_URL.
+#
+#   python loadtest/fake_upstream.py --count 2000 --port 8002
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from synthetic_catalog import SyntheticCatalog
+
+
+class UpstreamData:
+
+    def __init__(self, satellites_json, transmitters_json, celestrak_text, satnogs_tles):
+        self.satellites_json = satellites_json.encode("utf8")
+        self.transmitters_json = transmitters_json.encode("utf8")
+        self.celestrak_text = celestrak_text.encode("utf8")
+        self.satnogs_tles = satnogs_tles
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        satnogs_tles = {norad_cat_id: json.dumps(catalog.satnogs_tle_json(norad_cat_id)).encode("utf8")
+                        for norad_cat_id in catalog.satnogs_tles}
+
+        return cls(json.dumps(catalog.satellites), json.dumps(catalog.transmitters),
+                   SyntheticCatalog.tle_text(catalog.celestrak_tles), satnogs_tles)
+
+    @classmethod
+    def from_directory(cls, directory):
+        def read(filename):
+            with open(os.path.join(directory, filename)) as file:
+                return file.read()
+
+        return cls(read("satellites.json"), read("transmitters.json"), read("celestrak_tle.txt"), {})
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        data = self.server.data
+        url = urllib.parse.urlparse(self.path)
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if url.path == "/api/satellites/":
+            self._send(200, "application/json", data.satellites_json)
+        elif url.path == "/api/transmitters/":
+            self._send(200, "application/json", data.transmitters_json)
+        elif url.path == "/api/tle/":
+            norad_cat_id = urllib.parse.parse_qs(url.query).get("norad_cat_id", [""])[0]
+            if not norad_cat_id.isdigit():
+                self._send(400, "application/json", b'{"norad_cat_id": ["Enter a number."]}')
+            else:
+                self._send(200, "application/json", data.satnogs_tles.get(int(norad_cat_id), b"[]"))
+        elif url.path == "/NORAD/elements/active.txt":
+            self._send(200, "text/plain", data.celestrak_text)
+        elif url.path.startswith("/NORAD/elements/"):
+            self._send(200, "text/plain", b"")
+        else:
+            self._send(404, "text/plain", b"Not Found")
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeUpstream:
+
+    def __init__(self, data, host="127.0.0.1", port=0, latency=0.0):
+        self.server = ThreadingHTTPServer((host, port), UpstreamHandler)
+        self.server.daemon_threads = True
+        self.server.data = data
+        self.server.latency = latency
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://" + host + ":" + str(port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for db.satnogs.org and celestrak.com")
+    parser.add_argument("--count", type=int, default=1000, help="satellites in the synthetic catalog")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recorded", help="serve recorded responses from this directory instead")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    args = parser.parse_args()
+
+    if args.recorded:
+        data = UpstreamData.from_directory(args.recorded)
+    else:
+        data = UpstreamData.from_catalog(SyntheticCatalog(args.count, seed=args.seed))
+
+    upstream = FakeUpstream(data, port=args.port, latency=args.latency)
+    print("FAKE UPSTREAM | " + upstream.url)
+    upstream.server.serve_forever()
@@ -0,0 +1,364 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+# End-to-end HTTP load test.  Starts a local SatNOGS/CelesTrak stand-in, starts the API against it in a uvicorn
+# subprocess and drives a weighted mix of endpoints at a fixed concurrency, reporting throughput, latency
+# percentiles and error rates per endpoint.
+#
+#   python loadtest/run_loadtest.py --count 500 --concurrency 32 --duration 30 \
+#       --mix predict_now=8 satellites_by_name=1 satellites_by_norad_cat_id=1 --refresh-at 10
+#
+# --refresh-at triggers /admin/refresh/ part way through so the report can compare latency before, during and
+# after a catalog rebuild.  --target skips starting anything and loads an already running service.
+
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+LOADTEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIRECTORY = os.path.dirname(LOADTEST_DIRECTORY)
+sys.path.insert(0, LOADTEST_DIRECTORY)
+sys.path.insert(0, os.path.join(REPOSITORY_DIRECTORY, "benchmarks"))
+
+from fake_upstream import FakeUpstream, UpstreamData
+from synthetic_catalog import SyntheticCatalog
+
+
+def predict_now(rng, norad_cat_ids):
+    body = {"norad_cat_id": rng.choice(norad_cat_ids),
+            "observer_latitude": round(rng.uniform(-60, 60), 2),
+            "observer_longitude": round(rng.uniform(-180, 180), 2)}
+    return "POST", "/predict_now/", body
+
+
+def predict_batch(rng, norad_cat_ids):
+    body = [predict_now(rng, norad_cat_ids)[2] for _ in range(50)]
+    return "POST", "/predict_batch/", body
+
+
+def ephemeris(rng, norad_cat_ids):
+    body = {"norad_cat_id": rng.choice(norad_cat_ids),
+            "duration": 5400,
+            "step": 10,
+            "observer_latitude": round(rng.uniform(-60, 60), 2),
+            "observer_longitude": round(rng.uniform(-180, 180), 2)}
+    return "POST", "/ephemeris/", body
+
+
+def passes(rng, norad_cat_ids):
+    body = {"norad_cat_id": rng.choice(norad_cat_ids),
+            "observer_latitude": round(rng.uniform(-60, 60), 2),
+            "observer_longitude": round(rng.uniform(-180, 180), 2)}
+    return "POST", "/passes/", body
+
+
+def catalog(rng, norad_cat_ids):
+    return "GET", "/catalog/", None
+
+
+def satellites_by_name(rng, norad_cat_ids):
+    return "GET", "/satellites_by_name/", None
+
+
+def satellites_by_norad_cat_id(rng, norad_cat_ids):
+    return "GET", "/satellites_by_norad_cat_id/", None
+
+
+# each operation picks a request given the catalog; add new endpoints here to make them available to --mix
+OPERATIONS = {
+    "predict_now": predict_now,
+    "predict_batch": predict_batch,
+    "ephemeris": ephemeris,
+    "passes": passes,
+    "catalog": catalog,
+    "satellites_by_name": satellites_by_name,
+    "satellites_by_norad_cat_id": satellites_by_norad_cat_id,
+}
+
+
+def parse_mix(mix):
+    operations = []
+    weights = []
+    for item in mix:
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise SystemExit("UNKNOWN OPERATION | " + name + " | CHOOSE FROM " + ", ".join(sorted(OPERATIONS)))
+        operations.append(name)
+        weights.append(float(weight or 1))
+
+    return operations, weights
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Client:
+
+    def __init__(self, target, accept=None):
+        url = urllib.parse.urlparse(target)
+        self.host = url.hostname
+        self.port = url.port
+        self.accept = accept
+        self.connection = None
+
+    def request(self, method, path, body=None, timeout=60):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+        headers = {}
+        if self.accept:
+            headers["Accept"] = self.accept
+
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+
+        try:
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+
+
+class LoadTest:
+
+    def __init__(self, target, operations, weights, concurrency, duration, seed=0, accept=None):
+        self.target = target
+        self.accept = accept
+        self.operations = operations
+        self.weights = weights
+        self.concurrency = concurrency
+        self.duration = duration
+        self.seed = seed
+        self.norad_cat_ids = []
+
+        # (operation, start, latency, ok) per request, appended from every worker thread
+        self.samples = []
+        self.refresh = None
+
+    def wait_until_ready(self, timeout):
+        client = Client(self.target)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                status, body = client.request("GET", "/satellites_by_norad_cat_id/")
+                if status == 200:
+                    self.norad_cat_ids = [int(norad_cat_id) for norad_cat_id in json.loads(body)]
+                    if self.norad_cat_ids:
+                        return
+            except (OSError, http.client.HTTPException):
+                pass
+            time.sleep(0.5)
+
+        raise SystemExit("SERVICE NOT READY | " + self.target)
+
+    def worker(self, index, start, stop):
+        rng = random.Random(self.seed + index)
+        client = Client(self.target, self.accept)
+        samples = []
+
+        while time.monotonic() < stop:
+            operation = rng.choices(self.operations, self.weights)[0]
+            method, path, body = OPERATIONS[operation](rng, self.norad_cat_ids)
+
+            request_start = time.monotonic()
+            try:
+                status, _ = client.request(method, path, body)
+                ok = status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+            samples.append((operation, request_start - start, time.monotonic() - request_start, ok))
+
+        self.samples.extend(samples)
+
+    def refresher(self, start, delay):
+        time.sleep(delay)
+        client = Client(self.target)
+        refresh_start = time.monotonic()
+        try:
+            status, _ = client.request("POST", "/admin/refresh/", timeout=600)
+            ok = status < 400
+        except (OSError, http.client.HTTPException):
+            ok = False
+        self.refresh = (refresh_start - start, time.monotonic() - start, ok)
+
+    def run(self, refresh_at=None):
+        start = time.monotonic()
+        stop = start + self.duration
+
+        threads = [threading.Thread(target=self.worker, args=(index, start, stop))
+                   for index in range(self.concurrency)]
+        if refresh_at is not None:
+            threads.append(threading.Thread(target=self.refresher, args=(start, refresh_at)))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return self.report()
+
+    def summarize(self, samples, elapsed):
+        latencies = sorted(sample[2] for sample in samples)
+        errors = sum(1 for sample in samples if not sample[3])
+
+        return {"requests": len(samples),
+                "throughput": len(samples) / elapsed if elapsed > 0 else 0.0,
+                "p50": percentile(latencies, 0.50),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "error_rate": errors / len(samples) if samples else 0.0}
+
+    def report(self):
+        report = {"concurrency": self.concurrency,
+                  "duration": self.duration,
+                  "overall": self.summarize(self.samples, self.duration),
+                  "operations": {}}
+
+        for operation in self.operations:
+            samples = [sample for sample in self.samples if sample[0] == operation]
+            report["operations"][operation] = self.summarize(samples, self.duration)
+
+        if self.refresh is not None:
+            refresh_start, refresh_finish, ok = self.refresh
+            report["refresh"] = {"start": refresh_start, "duration": refresh_finish - refresh_start, "ok": ok}
+
+            for phase, low, high in [("before_refresh", 0, refresh_start),
+                                     ("during_refresh", refresh_start, refresh_finish),
+                                     ("after_refresh", refresh_finish, self.duration)]:
+                samples = [sample for sample in self.samples if low <= sample[1] < high]
+                report[phase] = self.summarize(samples, max(0.0, min(high, self.duration) - low))
+
+        return report
+
+
+def print_report(report):
+    print("%-30s %9s %10s %10s %10s %10s %8s" % ("", "REQUESTS", "REQ/S", "P50 MS", "P95 MS", "P99 MS", "ERRORS"))
+
+    rows = [("overall", report["overall"])] + list(report["operations"].items())
+    rows += [(phase, report[phase]) for phase in ["before_refresh", "during_refresh", "after_refresh"]
+             if phase in report]
+
+    for name, summary in rows:
+        print("%-30s %9d %10.1f %10.1f %10.1f %10.1f %7.2f%%" % (
+            name, summary["requests"], summary["throughput"], summary["p50"] * 1000, summary["p95"] * 1000,
+            summary["p99"] * 1000, summary["error_rate"] * 100))
+
+    if "refresh" in report:
+        print("REFRESH | STARTED AT %.1f s | TOOK %.1f s | %s" % (
+            report["refresh"]["start"], report["refresh"]["duration"], "OK" if report["refresh"]["ok"] else "FAILED"))
+
+
+def start_service(upstream_url, port, directory):
+    environment = dict(os.environ)
+    environment.update({"KEPLERMATIK_OFFLINE": "0",
+                        "KEPLERMATIK_ADMIN": "1",
+                        "KEPLERMATIK_SATNOGS_URL": upstream_url,
+                        "KEPLERMATIK_CELESTRAK_URL": upstream_url,
+                        "PYTHONPATH": REPOSITORY_DIRECTORY + os.pathsep + environment.get("PYTHONPATH", "")})
+
+    # the service writes its caches to the working directory, so keep them out of the checkout
+    log = open(os.path.join(directory, "service.log"), "wb")
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                             "--port", str(port), "--log-level", "warning"],
+                            cwd=directory, env=environment, stdout=log, stderr=subprocess.STDOUT)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keplermatik HTTP load test")
+    parser.add_argument("--count", type=int, default=500, help="satellites in the synthetic catalog")
+    parser.add_argument("--recorded", help="serve recorded upstream responses from this directory instead")
+    parser.add_argument("--upstream-latency", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--target", help="load an already running service at this URL")
+    parser.add_argument("--mix", nargs="+", default=["predict_now=8", "satellites_by_name=1",
+                                                     "satellites_by_norad_cat_id=1"],
+                        help="operation=weight pairs, from: " + ", ".join(sorted(OPERATIONS)))
+    parser.add_argument("--accept", help="Accept header sent with every request, e.g. application/msgpack")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--refresh-at", type=float, help="seconds into the run to trigger a catalog refresh")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    operations, weights = parse_mix(args.mix)
+
+    upstream = None
+    service = None
+    directory = tempfile.TemporaryDirectory()
+
+    try:
+        target = args.target
+        if target is None:
+            if args.recorded:
+                data = UpstreamData.from_directory(args.recorded)
+            else:
+                data = UpstreamData.from_catalog(SyntheticCatalog(args.count, seed=args.seed))
+
+            upstream = FakeUpstream(data, latency=args.upstream_latency).start()
+            service = start_service(upstream.url, args.port, directory.name)
+            target = "http://127.0.0.1:" + str(args.port)
+            print("FAKE UPSTREAM | " + upstream.url + " | SERVICE | " + target)
+
+        load_test = LoadTest(target, operations, weights, args.concurrency, args.duration, args.seed, args.accept)
+        load_test.wait_until_ready(args.startup_timeout)
+        print("LOAD TEST | " + str(len(load_test.norad_cat_ids)) + " SATELLITES | " + str(args.concurrency) +
+              " CLIENTS | " + str(args.duration) + " s")
+
+        report = load_test.run(args.refresh_at)
+        print_report(report)
+
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(report, file, indent=4)
+
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+        if upstream is not None:
+            upstream.stop()
+        directory.cleanup()
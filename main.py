@@ -25,13 +25,74 @@
 #     exception statement from all source files in the program, then also delete
 #     it in the license file.
 
-from keplermatik_satellites import Satellites
-from fastapi import FastAPI
+import asyncio
+import datetime
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+
+import keplermatik_encoding as encoding
+import keplermatik_metrics as metrics
+from keplermatik_cache import PredictionCache
+from keplermatik_profiling import PROFILE_HEADER, PROFILE_ID_HEADER, Profiler
+from keplermatik_satellites import Satellites, timescale, unknown_prediction_summary
+from keplermatik_schedule import PassScheduler, Station
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel
 import uvicorn
 
+# KEPLERMATIK_OFFLINE=0 fetches a fresh catalog from SatNOGS and CelesTrak instead of loading the local caches
+offline = os.environ.get("KEPLERMATIK_OFFLINE", "1") != "0"
+
 app = FastAPI()
-satellites = Satellites()
+
+# KEPLERMATIK_ADMIN=1 exposes /admin/refresh/, which rebuilds the whole catalog (and refetches it when online)
+admin_enabled = os.environ.get("KEPLERMATIK_ADMIN", "0") == "1"
+
+# the catalog is built on startup rather than at import and swapped out wholesale by /admin/refresh/; callers that
+# arrive while a refresh is running wait for that one instead of queueing another
+satellites = {}
+refresh_task = None
+
+prediction_cache = PredictionCache(ttl=1.0, time_bucket=1.0, observer_tolerance=0.01)
+
+event_loop_monitor = None
+
+# stations' rolling pass schedules cover the next KEPLERMATIK_SCHEDULE_DAYS and are advanced every
+# KEPLERMATIK_SCHEDULE_INTERVAL seconds
+scheduler = PassScheduler({}, horizon_days=float(os.environ.get("KEPLERMATIK_SCHEDULE_DAYS", "2")))
+schedule_interval = float(os.environ.get("KEPLERMATIK_SCHEDULE_INTERVAL", "60"))
+schedule_advancer = None
+
+profiler = Profiler.from_environment()
+
+
+def tle_ages():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [(now - satellite.tle.epoch).total_seconds() / 86400
+            for satellite in satellites.values() if satellite.tle.exists]
+
+
+metrics.registry.register(metrics.FunctionMetric(
+    "keplermatik_catalog_satellites", "Satellites in the catalog", lambda: len(satellites)))
+
+metrics.registry.register(metrics.FunctionMetric(
+    "keplermatik_prediction_cache_requests_total", "Prediction requests by cache outcome",
+    lambda: {("hit",): prediction_cache.hits,
+             ("miss",): prediction_cache.misses,
+             ("coalesced",): prediction_cache.coalesced},
+    labels=["result"], type="counter"))
+
+metrics.registry.register(metrics.FunctionMetric(
+    "keplermatik_prediction_cache_hit_ratio", "Fraction of prediction requests served without a new computation",
+    lambda: prediction_cache.stats["hit_rate"]))
+
+metrics.registry.register(metrics.FunctionHistogram(
+    "keplermatik_tle_age_days", "Age of the catalog's TLEs at scrape time", tle_ages,
+    buckets=(0.5, 1, 2, 3, 5, 7, 14, 30, 90, 365)))
 
 if __name__ == "__main__":
 
@@ -53,6 +114,101 @@ class PredictionRequest(BaseModel):
     observer_latitude: float
     observer_longitude: float
 
+class EphemerisRequest(BaseModel):
+    norad_cat_id: int
+    start: Optional[float] = None
+    duration: float = 5400.0
+    step: float = 60.0
+    observer_latitude: Optional[float] = None
+    observer_longitude: Optional[float] = None
+
+class StationRequest(BaseModel):
+    station_id: str
+    latitude: float
+    longitude: float
+    minimum_elevation: float = 0.0
+    norad_cat_ids: Optional[List[int]] = None
+
+class PassesRequest(BaseModel):
+    norad_cat_id: int
+    observer_latitude: float
+    observer_longitude: float
+    days: float = 1.0
+    minimum_elevation: float = 0.0
+
+MAXIMUM_EPHEMERIS_POINTS = 100000
+MAXIMUM_BATCH_PREDICTIONS = 1000
+
+
+def negotiated_media_type(request):
+    media_type = encoding.negotiate(request.headers.get("accept"))
+    if media_type is None:
+        raise HTTPException(status_code=406,
+                            detail="Supported media types: " + ", ".join(encoding.available_media_types()))
+
+    return media_type
+
+def get_satellite(norad_cat_id):
+    if norad_cat_id not in satellites:
+        raise HTTPException(status_code=404, detail="Unknown norad_cat_id " + str(norad_cat_id))
+
+    return satellites[norad_cat_id]
+
+@app.on_event("startup")
+async def load_satellites():
+    global satellites, event_loop_monitor, schedule_advancer
+    satellites = Satellites(offline=offline)
+    scheduler.update_catalog(satellites)
+
+    loop = asyncio.get_running_loop()
+    event_loop_monitor = loop.create_task(metrics.monitor_event_loop_lag())
+    schedule_advancer = loop.create_task(advance_schedules())
+
+
+async def advance_schedules():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(schedule_interval)
+        try:
+            await loop.run_in_executor(None, scheduler.advance)
+        except Exception as e:
+            print("SCHEDULE ERROR | " + repr(e))
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = "500"
+
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        # label by route template so paths with parameters don't each get their own series
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.http_request_seconds.observe(time.perf_counter() - start, request.method, path, status)
+
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    mode = profiler.requested_mode(request.headers.get(PROFILE_HEADER))
+    if mode is None:
+        return await call_next(request)
+
+    with profiler.profile_request(request.method + " " + request.url.path, mode) as profile:
+        response = await call_next(request)
+
+    response.headers[PROFILE_ID_HEADER] = profile.id
+    return response
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
@@ -76,23 +232,239 @@ async def satellites_by_norad_cat_id():
     test = ""
     return satellites_by_norad_cat_id
 
-@app.post("/predict_now/")
-async def predict_now(prediction_request: PredictionRequest):
+def require_admin():
+    if not admin_enabled:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+
+@app.post("/admin/refresh/")
+async def refresh_satellites(profile: str = None):
+    global refresh_task
+    require_admin()
+
+    if refresh_task is None or refresh_task.done():
+        refresh_task = asyncio.ensure_future(rebuild_catalog(profile))
+
+    # shielded so a caller hanging up doesn't cancel the refresh the others are waiting on
+    return await asyncio.shield(refresh_task)
+
+async def rebuild_catalog(profile=None):
+    global satellites
+
+    profile_id = None
+
+    loop = asyncio.get_running_loop()
+    if profile and profiler.enabled:
+        satellites, profile_id = await loop.run_in_executor(None, profiler.run, "refresh", profile,
+                                                            Satellites, offline)
+    else:
+        satellites = await loop.run_in_executor(None, Satellites, offline)
+    prediction_cache.clear()
+    await loop.run_in_executor(None, scheduler.update_catalog, satellites)
+
+    return {"satellites": len(satellites), "profile_id": profile_id}
+
+def require_profiling():
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+
+@app.get("/admin/profiles/")
+async def list_profiles():
+    require_profiling()
+    return profiler.list()
+
+@app.post("/admin/profiles/arm/")
+async def arm_profiler(count: int = 1):
+    require_profiling()
+    profiler.arm(count)
+    return {"armed": count}
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    require_profiling()
+    path = profiler.path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    return FileResponse(path, media_type="text/plain", filename=profile_id)
+
+@app.get("/prediction_cache/")
+async def prediction_cache_stats():
+    return prediction_cache.stats
+
+# /predict_now/ returns a raw Response in whichever encoding was negotiated, so its schema is documented per media type
+# rather than enforced through response_model
+PREDICTION_RESPONSES = {
+    200: {"model": Prediction,
+          "description": "The next pass.  JSON gives maximum_elevation as a \"12.34 degrees\" string; MessagePack "
+                         "and Arrow give it in degrees as a number, or null when there is no pass.",
+          "content": {encoding.MSGPACK: {}, encoding.ARROW: {}, encoding.ARROW_FILE: {}}},
+    404: {"description": "Unknown norad_cat_id"},
+    406: {"description": "None of the accepted media types are supported"},
+}
+
+PREDICTION_BATCH_RESPONSES = {
+    200: {"model": List[Prediction],
+          "description": "One prediction per request, in request order, with maximum_elevation shaped as for "
+                         "/predict_now/.  Unknown satellites get a row of nulls and empty times.",
+          "content": {encoding.MSGPACK: {}, encoding.ARROW: {}, encoding.ARROW_FILE: {}}},
+    400: {"description": "More than MAXIMUM_BATCH_PREDICTIONS requests"},
+    406: {"description": "None of the accepted media types are supported"},
+}
+
+@app.post("/predict_now/", responses=PREDICTION_RESPONSES)
+async def predict_now(prediction_request: PredictionRequest, request: Request):
+
+    media_type = negotiated_media_type(request)
 
     observer_latitude = prediction_request.observer_latitude
     observer_longitude = prediction_request.observer_longitude
     norad_cat_id = prediction_request.norad_cat_id
 
-    satellite = satellites[norad_cat_id]
-    satellite.predict_now(observer_latitude, observer_longitude)
+    satellite = get_satellite(norad_cat_id)
+
+    key = prediction_cache.key(norad_cat_id, observer_latitude, observer_longitude)
+    prediction = await prediction_cache.get(key, profiler.wrap(compute_prediction), satellite, observer_latitude,
+                                            observer_longitude)
+
+    return Response(content=encoding.encode_prediction(prediction, media_type), media_type=media_type)
+
+@app.post("/predict_batch/", responses=PREDICTION_BATCH_RESPONSES)
+async def predict_batch(prediction_requests: List[PredictionRequest], request: Request):
+    media_type = negotiated_media_type(request)
+
+    if len(prediction_requests) > MAXIMUM_BATCH_PREDICTIONS:
+        raise HTTPException(status_code=400,
+                            detail="At most " + str(MAXIMUM_BATCH_PREDICTIONS) + " predictions per request")
+
+    # known satellites go through the prediction cache so a batch shares results with /predict_now/ and with
+    # other batches in the same time bucket; the cache computes all of a batch's misses in one executor job
+    known = [prediction_request for prediction_request in prediction_requests
+             if prediction_request.norad_cat_id in satellites]
+    keys = [prediction_cache.key(prediction_request.norad_cat_id, prediction_request.observer_latitude,
+                                 prediction_request.observer_longitude)
+            for prediction_request in known]
+    arguments = [(satellites[prediction_request.norad_cat_id], prediction_request.observer_latitude,
+                  prediction_request.observer_longitude)
+                 for prediction_request in known]
+
+    computed = iter(await prediction_cache.get_many(keys, profiler.wrap(compute_prediction), arguments,
+                                                    return_exceptions=True))
+    predictions = []
+    for prediction_request in prediction_requests:
+        prediction = next(computed) if prediction_request.norad_cat_id in satellites else None
+        if isinstance(prediction, Exception):
+            # one satellite failing to propagate shouldn't fail the rest of the batch
+            print("PREDICTION ERROR | " + str(prediction_request.norad_cat_id) + " | " + repr(prediction))
+            prediction = None
+        predictions.append(prediction if prediction is not None else
+                           unknown_prediction_summary(prediction_request.norad_cat_id))
+
+    return Response(content=encoding.encode_predictions(predictions, media_type), media_type=media_type)
+
+@app.post("/ephemeris/")
+async def ephemeris(ephemeris_request: EphemerisRequest, request: Request):
+    media_type = negotiated_media_type(request)
+    satellite = get_satellite(ephemeris_request.norad_cat_id)
+
+    if ephemeris_request.step <= 0 or ephemeris_request.duration < 0:
+        raise HTTPException(status_code=400, detail="step must be positive and duration non-negative")
+    if ephemeris_request.duration / ephemeris_request.step >= MAXIMUM_EPHEMERIS_POINTS:
+        raise HTTPException(status_code=400,
+                            detail="At most " + str(MAXIMUM_EPHEMERIS_POINTS) + " points per request")
+
+    start = ephemeris_request.start if ephemeris_request.start is not None else time.time()
+    unix_times = start + np.arange(0.0, ephemeris_request.duration + ephemeris_request.step / 2,
+                                   ephemeris_request.step)
+
+    loop = asyncio.get_running_loop()
+    columns = await loop.run_in_executor(None, profiler.wrap(satellite.ephemeris), unix_times,
+                                         ephemeris_request.observer_latitude, ephemeris_request.observer_longitude)
+
+    return Response(content=encoding.encode_columns(columns, media_type), media_type=media_type)
+
+@app.post("/passes/")
+async def passes(passes_request: PassesRequest, request: Request):
+    media_type = negotiated_media_type(request)
+    satellite = get_satellite(passes_request.norad_cat_id)
+
+    now = timescale().now()
+    loop = asyncio.get_running_loop()
+    satellite_passes = await loop.run_in_executor(None, profiler.wrap(satellite.find_passes), now,
+                                                  now + passes_request.days,
+                                                  passes_request.observer_latitude,
+                                                  passes_request.observer_longitude,
+                                                  passes_request.minimum_elevation)
+
+    return Response(content=encoding.encode_rows(satellite_passes, media_type), media_type=media_type)
+
+@app.post("/stations/", status_code=202)
+async def register_station(station_request: StationRequest):
+    if station_request.norad_cat_ids is not None and len(station_request.norad_cat_ids) == 0:
+        raise HTTPException(status_code=422, detail="norad_cat_ids must list at least one satellite, "
+                                                    "or be left out to track the whole catalog")
+
+    station = Station(station_request.station_id, station_request.latitude, station_request.longitude,
+                      station_request.minimum_elevation, station_request.norad_cat_ids)
+
+    # the first full window search can take a while for a whole catalog, so it runs in the background; the
+    # schedule exists (not ready) from here on, and a failed search is reported by GET /stations/{station_id}
+    schedule = scheduler.add(station)
+    # not profiler.wrap: the search outlives this request, whose profile is saved when it returns
+    search = asyncio.get_running_loop().run_in_executor(None, scheduler.fill, schedule)
+    search.add_done_callback(report_station_search)
+
+    return {"station_id": station.station_id}
+
+def report_station_search(search):
+    if not search.cancelled() and search.exception() is not None:
+        print("SCHEDULE ERROR | " + repr(search.exception()))
+
+@app.delete("/stations/{station_id}")
+async def unregister_station(station_id: str):
+    if not scheduler.unregister(station_id):
+        raise HTTPException(status_code=404, detail="Unknown station " + station_id)
+
+    return {"station_id": station_id}
+
+@app.get("/stations/{station_id}")
+async def station_status(station_id: str):
+    schedule = scheduler.schedules.get(station_id)
+    if schedule is None:
+        raise HTTPException(status_code=404, detail="Unknown station " + station_id)
+
+    return {"station_id": station_id,
+            "ready": schedule.ready,
+            "error": schedule.error,
+            "passes": len(schedule.passes),
+            "horizon": schedule.horizon.utc_iso() if schedule.horizon is not None else None,
+            "updated": schedule.updated}
+
+@app.get("/stations/{station_id}/passes/")
+async def station_passes(station_id: str, request: Request, limit: Optional[int] = None):
+    media_type = negotiated_media_type(request)
+
+    station_schedule = scheduler.passes(station_id)
+    if station_schedule is None:
+        raise HTTPException(status_code=404, detail="Unknown station " + station_id)
+
+    if limit is not None:
+        station_schedule = station_schedule[:limit]
+
+    return Response(content=encoding.encode_rows(station_schedule, media_type), media_type=media_type)
+
+@app.get("/catalog/")
+async def catalog(request: Request):
+    media_type = negotiated_media_type(request)
+
+    epochs = [satellite.tle.epoch for satellite in satellites.values()]
+    columns = {"norad_cat_id": np.fromiter(satellites.keys(), dtype=np.int64, count=len(satellites)),
+               "name": [satellite.name for satellite in satellites.values()],
+               "tle_epoch": np.array([epoch.timestamp() if epoch else np.nan for epoch in epochs], dtype=float),
+               "transmitters": np.fromiter((len(satellite.transmitters) for satellite in satellites.values()),
+                                           dtype=np.int64, count=len(satellites))}
 
-    maximum_elevation = str(round(satellite.passes[0].maximum_elevation, 2)) + " degrees"
+    return Response(content=encoding.encode_columns(columns, media_type), media_type=media_type)
 
-    prediction = Prediction(norad_cat_id=satellite.norad_cat_id,
-                            latitude=satellite.latitude,
-                            longitude=satellite.longitude,
-                            rise_time=satellite.passes[0].rise_time,
-                            set_time=satellite.passes[0].set_time,
-                            maximum_elevation=maximum_elevation)
 
-    return prediction
+def compute_prediction(satellite, observer_latitude, observer_longitude):
+    return satellite.prediction_summary(observer_latitude, observer_longitude)
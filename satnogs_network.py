@@ -25,14 +25,35 @@
 #     exception statement from all source files in the program, then also delete
 #     it in the license file.
 
+import concurrent.futures
 import requests, re, os, pickle
 from requests_toolbelt.threaded import pool
 import warnings
 
 import simplejson
+import keplermatik_metrics as metrics
 import keplermatik_satellites
 import keplermatik_transmitters
 
+# overridable so the service can be pointed at a mirror or the local stand-ins in loadtest/
+SATNOGS_DB_URL = os.environ.get("KEPLERMATIK_SATNOGS_URL", "https://db.satnogs.org")
+CELESTRAK_URL = os.environ.get("KEPLERMATIK_CELESTRAK_URL", "https://celestrak.com")
+
+CELESTRAK_FILES = ['satnogs.txt', 'active.txt', 'tle-new.txt']
+
+# the TLE downloads wait on the network, not the CPU, so they get more threads than requests_toolbelt's default of
+# one per core
+FETCH_THREADS = 16
+
+
+def cached_norad_cat_ids(filename='satnogs_satellites'):
+    # catalog ids from the cached SatNOGS response, without building any Satellite objects
+    with open(filename, 'rb') as infile:
+        satellites_response = pickle.load(infile)
+
+    return [satellite['norad_cat_id'] for satellite in satellites_response.json()
+            if satellite['norad_cat_id'] != 99999 and satellite['norad_cat_id'] != None]
+
 
 class SatnogsClient:
 
@@ -42,50 +63,36 @@ class SatnogsClient:
         warnings.simplefilter('ignore', ResourceWarning)
 
     def get_satellites(self, offline = False):
+        if self.fetch_catalog(offline):
+            self.update_tles(celestrak_downloaded=True)
+
+    def fetch_catalog(self, offline=False):
+        # builds the satellites and their transmitters, downloading them unless offline; returns whether fresh
+        # data was downloaded, in which case the CelesTrak TLEs have been downloaded too
         satellites_response = None
         transmitters_response = None
+        celestrak_future = None
 
         if not offline:
 
-            satellites_url = 'https://db.satnogs.org/api/satellites/'
-            print("GETTING SATELLITES | " + satellites_url)
-            payload = {'status': 'alive'}
-
-            try:
-                satellites_response = requests.get(satellites_url, params=payload)
-                outfile = open('satnogs_satellites', 'wb')
-                pickle.dump(satellites_response, outfile)
-                outfile.close()
-
-                # now write output to a file
-                output = satellites_response.text
-                #todo:  with file open
-                satnogs_json_file = open("satnogs.json", "wb")
+            # the SatNOGS and CelesTrak downloads don't depend on each other, so they all run at once and the
+            # satellites are parsed while the transmitters and TLEs are still arriving
+            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+                satellites_future = executor.submit(self._fetch_satellites)
+                transmitters_future = executor.submit(self._fetch_transmitters)
+                celestrak_future = executor.submit(self._get_celestrak_tles, CELESTRAK_FILES)
 
-                #todo:  this is weird?
-                satnogs_json_file.write(
-                    simplejson.dumps(simplejson.loads(output), indent=4, sort_keys=True).encode('utf8'))
-                satnogs_json_file.close()
-
-            except:
-                print("NETWORK ERROR | USING CACHED SATNOGS SATELLITES")
-                offline = True
-
-            transmitters_url = 'https://db.satnogs.org/api/transmitters/'
-            transmitters_payload = {'status': 'active'}
-            print("GETTING TRANSMITTERS | " + transmitters_url)
-
-            try:
+                satellites_response = satellites_future.result()
+                if satellites_response is not None:
+                    self._parse_satellites(satellites_response)
+                else:
+                    offline = True
 
-                transmitters_response = requests.get('https://db.satnogs.org/api/transmitters/',
-                                                     params=transmitters_payload)
-                transmitters_outfile = open('satnogs_transmitters', 'wb')
-                pickle.dump(transmitters_response, transmitters_outfile)
-                transmitters_outfile.close()
+                transmitters_response = transmitters_future.result()
+                if transmitters_response is None:
+                    offline = True
 
-            except:
-                print("NETWORK ERROR | USING CACHED SATNOGS TRANSMITTERS")
-                offline = True
+                celestrak_future.result()
 
         if offline:
 
@@ -97,11 +104,8 @@ class SatnogsClient:
             transmitters_response = pickle.load(infile)
             infile.close()
 
-        for satellite in satellites_response.json():
-
-            # todo: SATNOGS appears to give some invalid satellites 99999 or None as norad_cat_id.  Might try without to find out if the invalid satellite trashing handles
-            if (satellite['norad_cat_id'] != 99999 and satellite['norad_cat_id'] != None):
-                self.satellites.update({satellite['norad_cat_id']: keplermatik_satellites.Satellite(satellite)})
+            self.satellites.clear()
+            self._parse_satellites(satellites_response)
 
         for transmitter in transmitters_response.json():
             self.transmitters.update({transmitter['uuid']: keplermatik_transmitters.Transmitter(transmitter)})
@@ -113,18 +117,78 @@ class SatnogsClient:
 
         del self.transmitters
 
-        if not offline:
-            self.update_tles()
+        return not offline
 
-    def update_tles(self):
+    def _fetch_satellites(self):
+        satellites_url = SATNOGS_DB_URL + '/api/satellites/'
+        print("GETTING SATELLITES | " + satellites_url)
+        payload = {'status': 'alive'}
+
+        try:
+            with metrics.upstream_fetch_seconds.time("satnogs_satellites"):
+                satellites_response = requests.get(satellites_url, params=payload)
+            outfile = open('satnogs_satellites', 'wb')
+            pickle.dump(satellites_response, outfile)
+            outfile.close()
+
+            # now write output to a file
+            output = satellites_response.text
+            #todo:  with file open
+            satnogs_json_file = open("satnogs.json", "wb")
+
+            #todo:  this is weird?
+            satnogs_json_file.write(
+                simplejson.dumps(simplejson.loads(output), indent=4, sort_keys=True).encode('utf8'))
+            satnogs_json_file.close()
+
+        except:
+            print("NETWORK ERROR | USING CACHED SATNOGS SATELLITES")
+            return None
+
+        return satellites_response
+
+    def _fetch_transmitters(self):
+        transmitters_url = SATNOGS_DB_URL + '/api/transmitters/'
+        transmitters_payload = {'status': 'active'}
+        print("GETTING TRANSMITTERS | " + transmitters_url)
+
+        try:
+
+            with metrics.upstream_fetch_seconds.time("satnogs_transmitters"):
+                transmitters_response = requests.get(transmitters_url, params=transmitters_payload)
+            transmitters_outfile = open('satnogs_transmitters', 'wb')
+            pickle.dump(transmitters_response, transmitters_outfile)
+            transmitters_outfile.close()
+
+        except:
+            print("NETWORK ERROR | USING CACHED SATNOGS TRANSMITTERS")
+            return None
+
+        return transmitters_response
+
+    def _parse_satellites(self, satellites_response):
+        for satellite in satellites_response.json():
+
+            # todo: SATNOGS appears to give some invalid satellites 99999 or None as norad_cat_id.  Might try without to find out if the invalid satellite trashing handles
+            if (satellite['norad_cat_id'] != 99999 and satellite['norad_cat_id'] != None):
+                self.satellites.update({satellite['norad_cat_id']: keplermatik_satellites.Satellite(satellite)})
+
+    def update_tles(self, celestrak_downloaded=False):
 
         print("UPDATING TLEs | " + str(len(self.satellites)) + " SATELLITES IN SATNOGS")
 
-        celestrak_files = ['satnogs.txt', 'active.txt', 'tle-new.txt']
-        self._get_celestrak_tles(celestrak_files)
-        self._get_satnogs_tles()
+        # a Satellites catalog collects its stage timings; callers passing a plain dict just get the printed lines
+        timings = getattr(self.satellites, "stage_timings", None)
+
+        if not celestrak_downloaded:
+            with metrics.stage("celestrak_tles", timings):
+                self._get_celestrak_tles(CELESTRAK_FILES)
+
+        with metrics.stage("satnogs_tles", timings):
+            self._get_satnogs_tles()
 
-        self._write_tle_files()
+        with metrics.stage("write_tle_files", timings):
+            self._write_tle_files()
 
     def _get_celestrak_tles(self, celestrack_files):
         tle_text = ""
@@ -133,10 +197,11 @@ class SatnogsClient:
         print("DOWNLOADING CELESTRAK TLEs | " + ', '.join(celestrack_files).upper())
 
         for filename in celestrack_files:
-            celestrak_urls.append('https://celestrak.com/NORAD/elements/' + filename)
+            celestrak_urls.append(CELESTRAK_URL + '/NORAD/elements/' + filename)
 
-        p = pool.Pool.from_urls(celestrak_urls)
-        p.join_all()
+        with metrics.upstream_fetch_seconds.time("celestrak"):
+            p = pool.Pool.from_urls(celestrak_urls, num_processes=max(1, min(FETCH_THREADS, len(celestrak_urls))))
+            p.join_all()
 
         for response in p.responses():
             tle_text += response.text
@@ -166,17 +231,18 @@ class SatnogsClient:
             if not satellite.tle_exists("celestrak_tle.txt"):
                 tle_not_found_count += 1
                 self.satellites.not_found_satellites.append(satellite.norad_cat_id)
-                manual_tle_urls.append('https://db.satnogs.org/api/tle/?norad_cat_id=' + str(satellite.norad_cat_id))
+                manual_tle_urls.append(SATNOGS_DB_URL + '/api/tle/?norad_cat_id=' + str(satellite.norad_cat_id))
 
         print("FOUND MISSING TLEs | " + str(tle_not_found_count) + " TLEs NOT FOUND")
 
-        p = pool.Pool.from_urls(manual_tle_urls)
-        p.join_all()
+        with metrics.upstream_fetch_seconds.time("satnogs_tle"):
+            p = pool.Pool.from_urls(manual_tle_urls, num_processes=max(1, min(FETCH_THREADS, len(manual_tle_urls))))
+            p.join_all()
         manual_tles = ""
 
         for response in p.responses():
             requested_norad_cat_id = int(
-                re.findall("https://db.satnogs.org/api/tle/\?norad_cat_id=(.*)", response.url)[0])
+                re.findall(re.escape(SATNOGS_DB_URL) + "/api/tle/\\?norad_cat_id=(.*)", response.url)[0])
             if (response.status_code != 400 and len(response.json()) != 0):
 
                 tle_json = response.json()
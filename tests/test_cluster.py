@@ -0,0 +1,293 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from keplermatik_cluster import HashRing, Router, Worker, WorkerDied
+from keplermatik_satellites import unknown_prediction_summary
+
+NORAD_CAT_IDS = list(range(10000, 12000))
+
+
+def owners(ring, keys):
+    return {key: ring.node_for(key) for key in keys}
+
+
+def test_ring_spreads_keys_over_every_node():
+    ring = HashRing(range(4))
+    partitions = ring.partition(NORAD_CAT_IDS)
+
+    assert set(partitions) == {0, 1, 2, 3}
+    assert sum(len(keys) for keys in partitions.values()) == len(NORAD_CAT_IDS)
+    assert min(len(keys) for keys in partitions.values()) > len(NORAD_CAT_IDS) / 4 * 0.7
+
+
+def test_joining_node_only_takes_keys():
+    ring = HashRing(range(4))
+    before = owners(ring, NORAD_CAT_IDS)
+
+    ring.add(4)
+    after = owners(ring, NORAD_CAT_IDS)
+
+    moved = [key for key in NORAD_CAT_IDS if before[key] != after[key]]
+    assert all(after[key] == 4 for key in moved)
+    assert len(moved) < len(NORAD_CAT_IDS) / 5 * 1.3
+
+
+def test_leaving_node_only_gives_up_its_own_keys():
+    ring = HashRing(range(4))
+    before = owners(ring, NORAD_CAT_IDS)
+
+    ring.remove(2)
+    after = owners(ring, NORAD_CAT_IDS)
+
+    assert 2 not in ring.nodes
+    assert [key for key in NORAD_CAT_IDS if before[key] != after[key]] == \
+        [key for key in NORAD_CAT_IDS if before[key] == 2]
+
+
+def test_copy_is_independent():
+    ring = HashRing(range(2))
+    copy = ring.copy()
+    copy.add(2)
+
+    assert ring.nodes == {0, 1}
+    assert owners(ring, NORAD_CAT_IDS) == owners(HashRing(range(2)), NORAD_CAT_IDS)
+
+
+def test_empty_ring_has_no_owner():
+    with pytest.raises(LookupError):
+        HashRing().node_for(25544)
+
+
+class FakeProcess:
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self, timeout=None):
+        pass
+
+    def terminate(self):
+        self.alive = False
+
+
+class FakeWorker(Worker):
+
+    # stands in for a worker process: holds its assigned ids, answers unknown for anything else, and is slow to
+    # assign so rebalances overlap with requests
+
+    def __init__(self, worker_id, assign_delay=0.005):
+        super().__init__(worker_id, FakeProcess(), None)
+        self.assign_delay = assign_delay
+        self.assigned = frozenset()
+        self.stopped = False
+
+    def call(self, operation, payload=None):
+        if self.dead or not self.process.is_alive():
+            self.dead = True
+            raise WorkerDied(self.worker_id)
+
+        if operation == "assign":
+            time.sleep(self.assign_delay)
+            self.assigned = frozenset(payload)
+            return len(self.assigned)
+        if operation == "predict_batch":
+            time.sleep(0.01)
+            return [{"norad_cat_id": norad_cat_id, "owner": self.worker_id} if norad_cat_id in self.assigned else
+                    unknown_prediction_summary(norad_cat_id) for norad_cat_id, latitude, longitude in payload]
+        if operation == "catalog":
+            return [(norad_cat_id, "SAT " + str(norad_cat_id)) for norad_cat_id in self.assigned]
+        if operation == "stop":
+            self.stopped = True
+            self.process.alive = False
+            return None
+
+        raise ValueError(operation)
+
+
+class FakeRouter(Router):
+
+    def _spawn(self):
+        worker = FakeWorker(self._next_worker_id)
+        self._next_worker_id += 1
+        self.workers[worker.worker_id] = worker
+        return worker
+
+
+@pytest.fixture
+def router():
+    router = FakeRouter(replicas=40)
+    router.norad_cat_ids = NORAD_CAT_IDS[:400]
+
+    with router._membership_lock:
+        ring = router.ring.copy()
+        for _ in range(3):
+            ring.add(router._spawn().worker_id)
+        router._rebalance(ring)
+
+    yield router
+    router.stop()
+
+
+def requests_for(norad_cat_ids):
+    return [(norad_cat_id, 40.0, -83.0) for norad_cat_id in norad_cat_ids]
+
+
+def test_rebalance_leaves_each_worker_with_its_partition(router):
+    router.add_worker()
+
+    partitions = router.ring.partition(router.norad_cat_ids)
+    assert set(partitions) == set(router.workers)
+    for worker_id, worker in router.workers.items():
+        assert worker.assigned == partitions[worker_id]
+        assert worker.satellite_count == len(partitions[worker_id])
+
+
+def test_removed_worker_is_stopped_after_rebalance(router):
+    removed = router.workers[1]
+    router.remove_worker(1)
+
+    assert removed.stopped
+    assert 1 not in router.ring.nodes
+    assert sorted(norad_cat_id for norad_cat_id, name in router.catalog()) == sorted(router.norad_cat_ids)
+
+
+def test_requests_during_rebalance_always_reach_an_owner(router):
+    # requests keep routing while workers join and leave; none may land on a worker that already dropped the id
+    failures = []
+    done = threading.Event()
+
+    def client():
+        while not done.is_set():
+            for result in router.predict_batch(requests_for(router.norad_cat_ids)):
+                if "owner" not in result:
+                    failures.append(result["norad_cat_id"])
+
+    clients = [threading.Thread(target=client) for _ in range(4)]
+    for thread in clients:
+        thread.start()
+
+    try:
+        for _ in range(3):
+            worker_id = router.add_worker()
+            router.remove_worker(worker_id)
+            router.remove_worker(min(router.workers))
+            router.add_worker()
+    finally:
+        done.set()
+        for thread in clients:
+            thread.join()
+
+    assert failures == []
+
+
+def test_swap_waits_for_requests_on_the_old_ring(router):
+    generation = router.generation
+    pinned = router._reading()
+    pinned.__enter__()
+
+    swapped = threading.Event()
+    swapper = threading.Thread(target=lambda: (router._swap_ring(router.ring.copy()), swapped.set()))
+    swapper.start()
+
+    assert not swapped.wait(0.1)
+    pinned.__exit__(None, None, None)
+    assert swapped.wait(1)
+    swapper.join()
+    assert router.generation == generation + 1
+
+
+def test_dead_worker_is_replaced_and_request_retried(router):
+    dead = router.workers[0]
+    dead.process.alive = False
+
+    results = router.predict_batch(requests_for(router.norad_cat_ids))
+
+    assert all("owner" in result for result in results)
+    assert 0 not in router.workers
+    assert 0 not in router.ring.nodes
+    assert len(router.workers) == 3
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="spawns worker processes")
+def test_worker_processes_survive_membership_changes_and_crashes(tmp_path):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+    from synthetic_catalog import SyntheticCatalog
+
+    catalog = SyntheticCatalog(60, missing_tle_fraction=0.0, satnogs_tle_fraction=0.0)
+    catalog.write(str(tmp_path))
+    norad_cat_ids = [satellite["norad_cat_id"] for satellite in catalog.satellites]
+
+    with Router(str(tmp_path), replicas=40).start(2) as router:
+        def known():
+            return [result["norad_cat_id"] for result in router.predict_batch(requests_for(norad_cat_ids))
+                    if result["latitude"] is not None]
+
+        assert known() == norad_cat_ids
+
+        router.add_worker()
+        router.remove_worker(0)
+        assert known() == norad_cat_ids
+
+        crashed = router.workers[1]
+        crashed.process.kill()
+        crashed.process.join()
+
+        assert known() == norad_cat_ids
+        assert 1 not in router.workers
+        assert len(router.workers) == 2
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="spawns worker processes")
+def test_refresh_picks_up_rewritten_caches(tmp_path):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+    from synthetic_catalog import SyntheticCatalog
+
+    SyntheticCatalog(40, missing_tle_fraction=0.0, satnogs_tle_fraction=0.0).write(str(tmp_path))
+
+    with Router(str(tmp_path), replicas=40).start(2) as router:
+        # the same seed generates the same first 40 satellites, so the rewrite only adds to the catalog
+        catalog = SyntheticCatalog(60, missing_tle_fraction=0.0, satnogs_tle_fraction=0.0)
+        catalog.write(str(tmp_path))
+        norad_cat_ids = [satellite["norad_cat_id"] for satellite in catalog.satellites]
+
+        status = router.refresh()
+
+        assert status["satellites"] == 60
+        assert sum(worker["satellites"] for worker in status["workers"].values()) == 60
+        assert [result["norad_cat_id"] for result in router.predict_batch(requests_for(norad_cat_ids))
+                if result["latitude"] is not None] == norad_cat_ids
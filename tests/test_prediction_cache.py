@@ -0,0 +1,219 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from keplermatik_cache import PredictionCache
+
+
+class Computation:
+
+    # compute callable that blocks in the executor until released, so tests control when a result lands
+
+    def __init__(self, result="prediction", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self, *args):
+        self.calls += 1
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return (self.result,) + args
+
+
+def test_key_quantises_observer_and_time():
+    cache = PredictionCache(time_bucket=1.0, observer_tolerance=0.01)
+
+    assert cache.key(25544, 40.001, -83.002, 100.2) == cache.key(25544, 40.003, -83.0, 100.9)
+    assert cache.key(25544, 40.0, -83.0, 100.2) != cache.key(25544, 40.0, -83.0, 101.2)
+    assert cache.key(25544, 40.0, -83.0, 100.2) != cache.key(43017, 40.0, -83.0, 100.2)
+
+
+def test_concurrent_identical_requests_share_one_computation():
+    cache = PredictionCache()
+    compute = Computation()
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(cache.get("key", compute, 1)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        compute.release.set()
+        return await asyncio.gather(*waiters)
+
+    results = asyncio.run(scenario())
+
+    assert compute.calls == 1
+    assert results == [("prediction", 1)] * 5
+    assert cache.misses == 1
+    assert cache.coalesced == 4
+    assert cache.stats["in_flight"] == 0
+
+
+def test_results_are_cached_until_ttl_expires():
+    cache = PredictionCache(ttl=0.1)
+    compute = Computation()
+    compute.release.set()
+
+    async def scenario():
+        await cache.get("key", compute)
+        await cache.get("key", compute)
+        await asyncio.sleep(0.15)
+        await cache.get("key", compute)
+
+    asyncio.run(scenario())
+
+    assert compute.calls == 2
+    assert cache.hits == 1
+    assert cache.misses == 2
+
+
+def test_exceptions_reach_every_waiter_and_are_not_cached():
+    cache = PredictionCache()
+    failing = Computation(error=ValueError("no TLE"))
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(cache.get("key", failing)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        failing.release.set()
+        return await asyncio.gather(*waiters, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert failing.calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert cache.stats["entries"] == 0
+
+    working = Computation()
+    working.release.set()
+    assert asyncio.run(cache.get("key", working)) == ("prediction",)
+    assert working.calls == 1
+
+
+def test_cancelled_waiter_does_not_cancel_shared_computation():
+    cache = PredictionCache()
+    compute = Computation()
+
+    async def scenario():
+        cancelled = asyncio.ensure_future(cache.get("key", compute))
+        survivor = asyncio.ensure_future(cache.get("key", compute))
+        await asyncio.sleep(0.05)
+
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+        compute.release.set()
+        return await survivor
+
+    assert asyncio.run(scenario()) == ("prediction",)
+    assert compute.calls == 1
+    assert cache.stats["entries"] == 1
+
+
+def test_get_many_computes_misses_in_one_job_and_shares_with_get():
+    cache = PredictionCache()
+    compute = Computation()
+    compute.release.set()
+
+    async def scenario():
+        await cache.get("cached", compute, 0)
+        return await cache.get_many(["cached", "a", "b", "a"], compute, [(0,), (1,), (2,), (1,)])
+
+    results = asyncio.run(scenario())
+
+    assert results == [("prediction", 0), ("prediction", 1), ("prediction", 2), ("prediction", 1)]
+    assert compute.calls == 3
+    assert (cache.hits, cache.misses, cache.coalesced) == (1, 3, 1)
+
+
+def test_get_many_failure_is_not_cached():
+    cache = PredictionCache()
+    failing = Computation(error=ValueError("no TLE"))
+    failing.release.set()
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await cache.get_many(["a", "b"], failing, [(), ()])
+
+    asyncio.run(scenario())
+
+    assert cache.stats["entries"] == 0
+    assert cache.stats["in_flight"] == 0
+
+
+def test_prune_drops_expired_entries_when_full():
+    cache = PredictionCache(ttl=0.05, max_entries=2)
+    compute = Computation()
+    compute.release.set()
+
+    async def scenario():
+        await cache.get("a", compute)
+        await cache.get("b", compute)
+        time.sleep(0.06)
+        await cache.get("c", compute)
+
+    asyncio.run(scenario())
+
+    assert cache.stats["entries"] == 1
+
+
+def test_get_many_failure_only_fails_its_own_key():
+    cache = PredictionCache()
+
+    def compute(value):
+        if value == "bad":
+            raise ValueError("no TLE")
+        return ("prediction", value)
+
+    async def scenario():
+        # a single request for "a" coalesces onto the batch's computation, which also holds the failing key
+        batch = asyncio.ensure_future(cache.get_many(["a", "bad", "b"], compute, [("a",), ("bad",), ("b",)],
+                                                     return_exceptions=True))
+        await asyncio.sleep(0)
+        single = asyncio.ensure_future(cache.get("a", compute, "a"))
+        return await batch, await single
+
+    batch_results, single_result = asyncio.run(scenario())
+
+    assert batch_results[0] == ("prediction", "a")
+    assert isinstance(batch_results[1], ValueError)
+    assert batch_results[2] == ("prediction", "b")
+    assert single_result == ("prediction", "a")
+    assert cache.coalesced == 1
+    assert cache.stats["entries"] == 2
+
+    async def raising():
+        with pytest.raises(ValueError):
+            await cache.get_many(["bad"], compute, [("bad",)])
+
+    asyncio.run(raising())
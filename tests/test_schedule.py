@@ -0,0 +1,180 @@
+#
+#     Copyright (C) 2019-present Nathan Odle
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the Server Side Public License, version 1,
+#     as published by MongoDB, Inc.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     Server Side Public License for more details.
+#
+#     You should have received a copy of the Server Side Public License
+#     along with this program. If not, email mysteriousham73@gmail.com
+#
+#     As a special exception, the copyright holders give permission to link the
+#     code of portions of this program with the OpenSSL library under certain
+#     conditions as described in each individual source file and distribute
+#     linked combinations including the program with the OpenSSL library. You
+#     must comply with the Server Side Public License in all respects for
+#     all of the code used other than as permitted herein. If you modify file(s)
+#     with this exception, you may extend this exception to your version of the
+#     file(s), but you are not obligated to do so. If you do not wish to do so,
+#     delete this exception statement from your version. If you delete this
+#     exception statement from all source files in the program, then also delete
+#     it in the license file.
+
+import os
+import sys
+
+import pytest
+
+import keplermatik_schedule
+from keplermatik_satellites import Satellite, timescale
+from keplermatik_schedule import PassScheduler, Station
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from synthetic_catalog import SyntheticCatalog
+
+LATITUDE = 40.8939
+LONGITUDE = -83.8917
+
+
+class Clock:
+
+    # stands in for the timescale the scheduler reads "now" from
+
+    def __init__(self, t):
+        self.t = t
+
+    def now(self):
+        return self.t
+
+    def __getattr__(self, name):
+        return getattr(timescale(), name)
+
+
+@pytest.fixture(scope="module")
+def catalog_satellites(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("catalog")
+    catalog = SyntheticCatalog(400, seed=7, missing_tle_fraction=0.0, satnogs_tle_fraction=0.0)
+    catalog.write(str(directory))
+
+    satellites = {}
+    for satellite_json in catalog.satellites:
+        satellite = Satellite(satellite_json)
+        satellite.load_tle(str(directory / "tle_cache.txt"))
+        satellites[satellite.norad_cat_id] = satellite
+
+    return satellites
+
+
+def orbit_class(satellites, minimum_mean_motion, maximum_mean_motion, count):
+    # mean motion in revolutions per day from line 2 of the TLE
+    selected = {norad_cat_id: satellite for norad_cat_id, satellite in satellites.items()
+                if minimum_mean_motion <= float(satellite.tle.tle_lines[2][52:63]) < maximum_mean_motion}
+    return dict(list(selected.items())[:count])
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(timescale().utc(2026, 10, 19, 12, 0, 0))
+    monkeypatch.setattr(keplermatik_schedule, "timescale", lambda: clock)
+    return clock
+
+
+def pass_times(schedule):
+    return [(satellite_pass.norad_cat_id, satellite_pass.rise_time, satellite_pass.set_time)
+            for satellite_pass in schedule.passes]
+
+
+def assert_same_passes(rolling, fresh):
+    # rise and set times can round to a different second depending on where a search window started
+    rolling = sorted(pass_times(rolling))
+    fresh = sorted(pass_times(fresh))
+    assert len(rolling) == len(fresh), (rolling, fresh)
+
+    for (rolling_id, rolling_rise, rolling_set), (fresh_id, fresh_rise, fresh_set) in zip(rolling, fresh):
+        assert rolling_id == fresh_id
+        assert abs(seconds(rolling_rise) - seconds(fresh_rise)) <= 2
+        assert abs(seconds(rolling_set) - seconds(fresh_set)) <= 2
+
+
+def seconds(iso):
+    t = timescale().utc(int(iso[0:4]), int(iso[5:7]), int(iso[8:10]), int(iso[11:13]), int(iso[14:16]),
+                        int(iso[17:19]))
+    return t.tt * 86400
+
+
+def advance_and_compare(satellites, clock, step_minutes, hours, horizon_days):
+    scheduler = PassScheduler(satellites, horizon_days=horizon_days)
+    station = Station("rolling", LATITUDE, LONGITUDE)
+    rolling = scheduler.register(station)
+
+    for _ in range(int(hours * 60 / step_minutes)):
+        clock.t = clock.t + step_minutes / 1440.0
+        scheduler.advance()
+
+    fresh = PassScheduler(satellites, horizon_days=horizon_days).register(Station("fresh", LATITUDE, LONGITUDE))
+
+    assert rolling.passes
+    assert_same_passes(rolling, fresh)
+    return rolling
+
+
+def test_rolling_schedule_matches_fresh_search_for_leo(catalog_satellites, clock):
+    satellites = orbit_class(catalog_satellites, 14.0, 17.0, 12)
+    advance_and_compare(satellites, clock, step_minutes=7, hours=6, horizon_days=0.25)
+
+
+def test_rolling_schedule_matches_fresh_search_for_meo(catalog_satellites, clock):
+    # MEO passes last hours, longer than any fixed overlap between one search and the next
+    satellites = orbit_class(catalog_satellites, 2.0, 12.0, 24)
+    rolling = advance_and_compare(satellites, clock, step_minutes=5, hours=6, horizon_days=0.25)
+
+    longest = max(seconds(satellite_pass.set_time) - seconds(satellite_pass.rise_time)
+                  for satellite_pass in rolling.passes)
+    assert longest > 3600
+
+
+def test_first_search_finds_pass_in_progress(catalog_satellites, clock):
+    satellites = orbit_class(catalog_satellites, 2.0, 12.0, 24)
+    schedule = PassScheduler(satellites, horizon_days=0.25).register(Station("station", LATITUDE, LONGITUDE))
+
+    now = clock.now().utc_iso()
+    in_progress = [satellite_pass for satellite_pass in schedule.passes if satellite_pass.rise_time < now]
+    assert in_progress
+    assert all(satellite_pass.set_time >= now for satellite_pass in in_progress)
+
+
+def test_tle_change_re_search_matches_fresh_search(catalog_satellites, clock):
+    satellites = dict(orbit_class(catalog_satellites, 2.0, 12.0, 12))
+    scheduler = PassScheduler(satellites, horizon_days=0.25)
+    rolling = scheduler.register(Station("rolling", LATITUDE, LONGITUDE))
+
+    clock.t = clock.t + 2 / 24.0
+    scheduler.advance()
+
+    # a refresh that drops one satellite and hands every other one a TLE it hasn't searched with
+    refreshed = dict(list(satellites.items())[1:])
+    for satellite in refreshed.values():
+        rolling.tle_lines[satellite.norad_cat_id] = ()
+    scheduler.update_catalog(refreshed)
+
+    fresh = PassScheduler(refreshed, horizon_days=0.25).register(Station("fresh", LATITUDE, LONGITUDE))
+    fresh_horizon_passes = [satellite_pass for satellite_pass in fresh.passes
+                            if satellite_pass.set_time <= rolling.horizon.utc_iso()]
+    rolling_passes = [satellite_pass for satellite_pass in rolling.passes
+                      if satellite_pass.set_time <= rolling.horizon.utc_iso()]
+
+    assert list(satellites)[0] not in {satellite_pass.norad_cat_id for satellite_pass in rolling.passes}
+    assert len(rolling_passes) == len(fresh_horizon_passes)
+
+
+def test_empty_filter_tracks_nothing(catalog_satellites, clock):
+    satellites = orbit_class(catalog_satellites, 14.0, 17.0, 4)
+    scheduler = PassScheduler(satellites, horizon_days=0.25)
+
+    assert scheduler.register(Station("none", LATITUDE, LONGITUDE, norad_cat_ids=[])).passes == ()
+    assert scheduler.register(Station("all", LATITUDE, LONGITUDE)).passes